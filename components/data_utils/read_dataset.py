@@ -0,0 +1,78 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .schema import SCHEMA
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_dataset(filename, columns=None, chunksize=None):
+    """
+    Read a CSV file of the NYC Airbnb dataset applying the project schema: numeric columns are
+    downcast, low-cardinality text columns become categoricals and free text uses Arrow-backed
+    strings. Only the requested columns are parsed
+
+    :param filename: path to the CSV file
+    :param columns: columns to read (default: all the columns in the file)
+    :param chunksize: if provided, return an iterator over DataFrames of this many rows
+    :return: a pandas DataFrame (or an iterator of DataFrames if chunksize is provided)
+    """
+    # Columns outside of the schema (if any) are left to pandas' type inference
+    dtype = {
+        col: kind for col, kind in SCHEMA.items()
+        if kind != "integer" and (columns is None or col in columns)
+    }
+
+    reader = pd.read_csv(filename, usecols=columns, dtype=dtype, chunksize=chunksize)
+
+    if chunksize is not None:
+        return (_downcast(chunk) for chunk in reader)
+
+    df = _downcast(reader)
+
+    optimized = df.memory_usage(deep=True).sum()
+    baseline = _object_memory_usage(df)
+    logger.info(
+        f"Loaded {df.shape[0]} rows x {df.shape[1]} columns from {filename}: "
+        f"{optimized / 2**20:.1f} MB (~{baseline / 2**20:.1f} MB with default dtypes)"
+    )
+
+    return df
+
+
+def _downcast(df):
+    for col in df.columns:
+        # Integer columns with missing values are parsed as float64, which we keep to avoid
+        # losing precision on large ids
+        if SCHEMA.get(col) == "integer" and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+
+    return df
+
+
+def _object_memory_usage(df):
+    """
+    Estimate the memory that df would take with the default pandas dtypes (64-bit numbers and
+    Python strings), without materializing it
+    """
+    n_bytes = 0
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_numeric_dtype(s):
+            n_bytes += 8 * len(s)
+            continue
+
+        # Each value is a pointer to a Python str of ~49 bytes of overhead plus its length
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            # Missing values have code -1, which picks the trailing 0
+            lengths = np.append(s.cat.categories.astype(str).str.len().to_numpy(), 0)
+            str_lengths = lengths[s.cat.codes.to_numpy()]
+        else:
+            str_lengths = s.str.len().fillna(0).to_numpy()
+
+        n_bytes += len(s) * (8 + 49) + int(str_lengths.sum())
+
+    return n_bytes
@@ -0,0 +1,32 @@
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    # Arrow-backed strings that use np.nan for missing values, so they can be fed to scikit-learn
+    STRING_DTYPE = pd.StringDtype("pyarrow_numpy")
+except ImportError:
+    STRING_DTYPE = object
+
+
+# Columns of the NYC Airbnb dataset in their expected order, with their in-memory representation.
+# Integers are read as int64 and then downcast, since they might contain missing values. The coordinates
+# stay float64: they have more digits than float32 can hold, and they are compared with the bounds of NYC
+# and written back to the cleaned dataset
+SCHEMA = {
+    "id": "integer",
+    "name": STRING_DTYPE,
+    "host_id": "integer",
+    "host_name": STRING_DTYPE,
+    "neighbourhood_group": "category",
+    "neighbourhood": "category",
+    "latitude": "float64",
+    "longitude": "float64",
+    "room_type": "category",
+    "price": "integer",
+    "minimum_nights": "integer",
+    "number_of_reviews": "integer",
+    "last_review": STRING_DTYPE,
+    "reviews_per_month": "float32",
+    "calculated_host_listings_count": "integer",
+    "availability_365": "integer",
+}
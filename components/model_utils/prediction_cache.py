@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+# Types inferred by pandas for object columns holding numbers
+_NUMERIC_INFERRED = ("integer", "floating", "mixed-integer-float", "decimal", "empty")
+
+
+class PredictionCache:
+    """
+    Memoize the predictions of a model, keyed on a hash of the feature columns of each input row and
+    on the model version. Entries are evicted in least-recently-used order when the cache is full,
+    and expire after ``ttl`` seconds (if provided). Only the rows that are not in the cache are sent
+    to the model, in a single batch.
+
+    The cached prediction of a row is only equal to the uncached one if the model predicts each row
+    independently of the other rows in the batch (no statistics computed on the batch at predict time).
+
+    :param model: any object with a ``predict`` method accepting a pandas DataFrame
+    :param model_version: identifier of the model (for example the digest of its W&B artifact)
+    :param max_size: maximum number of predictions to keep
+    :param ttl: time to live of each prediction in seconds (default: no expiration)
+    :param feature_columns: columns used to compute the key (default: all the input columns)
+    """
+
+    def __init__(self, model, model_version, max_size=100000, ttl=None, feature_columns=None):
+        self.model = model
+        self.model_version = str(model_version)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.feature_columns = feature_columns
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def predict(self, X):
+        """
+        Return the predictions for the rows of X, computing only the ones not in the cache
+        """
+        keys = self.row_keys(X)
+        y_pred = np.empty(len(keys), dtype=np.float64)
+        missing = np.zeros(len(keys), dtype=bool)
+
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys.tolist()):
+                entry = self._entries.get(key)
+                if entry is not None and self.ttl is not None and entry[1] < now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+
+                if entry is None:
+                    missing[i] = True
+                else:
+                    self._entries.move_to_end(key)
+                    y_pred[i] = entry[0]
+
+            self.hits += int((~missing).sum())
+            self.misses += int(missing.sum())
+
+        if missing.any():
+            # Rows repeated within the batch are predicted only once
+            missing_keys, first, inverse = np.unique(keys[missing], return_index=True, return_inverse=True)
+            predictions = np.asarray(self.model.predict(X.iloc[np.flatnonzero(missing)[first]]))
+            y_pred[missing] = predictions[inverse]
+            self._store(missing_keys.tolist(), predictions)
+
+        return y_pred
+
+    def row_keys(self, X):
+        """
+        Return a 64-bit hash for each row of X. Whole numbers are compared exactly, the other numbers at
+        float32 precision (the one of the float32 columns of read_dataset) and everything else as Python objects, so the same
+        row hashes the same whether it was loaded with read_dataset, pd.read_csv or from JSON
+        """
+        columns = sorted(self.feature_columns if self.feature_columns is not None else X.columns)
+        canonical = pd.DataFrame({col: _canonical_column(X[col]) for col in columns}, index=X.index)
+        # Prepend the model version as an extra column, so a new model never reuses stale predictions
+        canonical.insert(0, "__model_version__", self.model_version)
+
+        return pd.util.hash_pandas_object(canonical, index=False).to_numpy()
+
+    def stats(self):
+        """
+        Return the cache metrics as a dictionary
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, keys, predictions):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            for key, prediction in zip(keys, predictions):
+                self._entries[key] = (prediction, expires)
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+def _canonical_column(s):
+    if pd.api.types.is_numeric_dtype(s) or pd.api.types.infer_dtype(s, skipna=True) in _NUMERIC_INFERRED:
+        values = s.to_numpy(dtype=np.float64, na_value=np.nan)
+        # Round the fractional numbers to float32, so a value parsed as float64 matches its float32 copy
+        with np.errstate(invalid="ignore", over="ignore"):
+            rounded = np.where(np.mod(values, 1) == 0, values, values.astype(np.float32).astype(np.float64))
+        return pd.Series(rounded, index=s.index)
+    return s.astype(object)
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from model_utils.prediction_cache import PredictionCache
+
+
+class CountingModel:
+    """
+    Predicts the sum of the numeric columns of each row, recording the number of rows it is sent
+    """
+
+    def __init__(self):
+        self.n_rows = []
+
+    def predict(self, X):
+        self.n_rows.append(len(X))
+        return X.select_dtypes("number").sum(axis=1).to_numpy()
+
+
+def make_rows():
+    return pd.DataFrame({
+        "latitude": [40.64749, 40.75362, 40.80902],
+        "minimum_nights": [1, 2, 3],
+        "room_type": ["Private room", "Entire home/apt", "Shared room"],
+    })
+
+
+def test_only_missing_rows_are_predicted():
+    model = CountingModel()
+    cache = PredictionCache(model, "v1")
+    X = make_rows()
+
+    first = cache.predict(X.iloc[:2])
+    both = cache.predict(X)
+
+    assert model.n_rows == [2, 1]
+    np.testing.assert_array_equal(both, model.predict(X))
+    np.testing.assert_array_equal(both[:2], first)
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 3
+
+
+def test_repeated_rows_are_predicted_once():
+    model = CountingModel()
+    X = make_rows().iloc[[0, 1, 0, 0]]
+
+    y_pred = PredictionCache(model, "v1").predict(X)
+
+    assert model.n_rows == [2]
+    assert y_pred[0] == y_pred[2] == y_pred[3]
+
+
+def test_keys_do_not_depend_on_dtypes():
+    cache = PredictionCache(CountingModel(), "v1")
+    X = make_rows()
+
+    # As loaded by read_dataset (float32, small integers, categoricals), or from JSON (objects)
+    compact = X.astype({"latitude": np.float32, "minimum_nights": np.int8, "room_type": "category"})
+    objects = X.astype(object)
+
+    keys = cache.row_keys(X)
+    np.testing.assert_array_equal(cache.row_keys(compact), keys)
+    np.testing.assert_array_equal(cache.row_keys(objects), keys)
+    # Whole numbers are compared exactly, even when they are stored as floats because of missing values
+    np.testing.assert_array_equal(
+        cache.row_keys(pd.DataFrame({"id": [2**40 + 1, None]}))[:1],
+        cache.row_keys(pd.DataFrame({"id": [2**40 + 1]}))
+    )
+    assert len(set(keys)) == len(X)
+
+
+def test_keys_depend_on_model_version_and_feature_columns():
+    X = make_rows()
+    keys = PredictionCache(None, "v1", feature_columns=["latitude"]).row_keys(X)
+
+    assert not np.array_equal(PredictionCache(None, "v2", feature_columns=["latitude"]).row_keys(X), keys)
+    # Columns that are not features do not change the key
+    np.testing.assert_array_equal(
+        PredictionCache(None, "v1", feature_columns=["latitude"]).row_keys(X.assign(room_type="x")), keys
+    )
+
+
+def test_eviction():
+    model = CountingModel()
+    cache = PredictionCache(model, "v1", max_size=2)
+    X = make_rows()
+
+    cache.predict(X.iloc[[0]])
+    cache.predict(X.iloc[[1]])
+    cache.predict(X.iloc[[0]])  # Row 1 is now the least recently used
+    cache.predict(X.iloc[[2]])
+    cache.predict(X.iloc[[0]])
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 2
+
+
+def test_expiration(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("model_utils.prediction_cache.time.monotonic", lambda: now[0])
+    model = CountingModel()
+    cache = PredictionCache(model, "v1", ttl=10)
+    X = make_rows().iloc[[0]]
+
+    cache.predict(X)
+    now[0] = 5.0
+    cache.predict(X)
+    now[0] = 20.0
+    cache.predict(X)
+
+    assert model.n_rows == [1, 1]
+    assert cache.stats()["expirations"] == 1
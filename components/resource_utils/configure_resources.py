@@ -0,0 +1,94 @@
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+# Environment variables read by the native thread pools (OpenMP, BLAS, numexpr) and by joblib
+THREAD_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+
+
+def resource_environment(n_jobs, blas_threads, joblib_backend):
+    """
+    Return the environment variables that communicate the resource budget of a step to its
+    process (and to the native libraries it loads, which read them at import time)
+
+    :param n_jobs: dictionary mapping each step to the number of workers (threads or processes) it can use
+    :param blas_threads: threads of the OpenMP/BLAS pools within each worker
+    :param joblib_backend: joblib backend of the steps ("loky", "threading"...), or None to let each
+                           library choose
+    :return: dictionary of environment variables
+    """
+    env = {var: str(blas_threads) for var in THREAD_VARIABLES}
+    env.update({
+        # Steps running at the same time share the environment, so it holds the budget of all of them
+        "PIPELINE_N_JOBS": json.dumps(n_jobs),
+        "PIPELINE_BLAS_THREADS": str(blas_threads),
+        "PIPELINE_JOBLIB_BACKEND": joblib_backend or "",
+    })
+    return env
+
+
+def configure_resources(phase):
+    """
+    Apply the resource budget set by the pipeline (see resource_environment) to the current
+    process, and log the resulting parallelism. When a step runs outside of the pipeline it can use
+    all the CPUs and the native thread pools are left untouched
+
+    :param phase: name of the pipeline step, used to look up its budget and in the report
+    :return: dictionary with the effective n_jobs, blas_threads and joblib_backend, plus the size
+             of the native thread pools
+    """
+    n_jobs = json.loads(os.environ.get("PIPELINE_N_JOBS", "{}")).get(phase, os.cpu_count() or 1)
+    blas_threads = os.environ.get("PIPELINE_BLAS_THREADS")
+
+    # Read by loky when it sizes its pool of worker processes
+    os.environ["LOKY_MAX_CPU_COUNT"] = str(n_jobs)
+
+    joblib_backend = os.environ.get("PIPELINE_JOBLIB_BACKEND") or None
+
+    # The libraries are imported here, so the pipeline can build the environment without them.
+    # Without threadpoolctl the native pools are still limited by the environment variables
+    try:
+        from threadpoolctl import threadpool_info, threadpool_limits
+        has_threadpoolctl = True
+    except ImportError:
+        has_threadpoolctl = False
+
+    if blas_threads is not None:
+        blas_threads = int(blas_threads)
+        if has_threadpoolctl:
+            # Pools already initialized before the environment was read are limited explicitly
+            threadpool_limits(limits=blas_threads)
+
+    if joblib_backend is not None:
+        from joblib import parallel_backend
+        # Entered for the rest of the process, so every joblib call of the step (in scikit-learn too)
+        # uses this backend, with the budget of the step as the default number of jobs
+        parallel_backend(joblib_backend, n_jobs=n_jobs).__enter__()
+
+    try:
+        import pyarrow
+        pyarrow.set_cpu_count(n_jobs)
+    except ImportError:
+        pass
+
+    resources = {
+        "n_jobs": n_jobs,
+        "blas_threads": blas_threads,
+        "joblib_backend": joblib_backend,
+        "thread_pools": {
+            pool["internal_api"]: pool["num_threads"] for pool in (threadpool_info() if has_threadpoolctl else [])
+        },
+    }
+    logger.info(f"Resources for {phase}: {resources}")
+
+    return resources
@@ -6,11 +6,13 @@ setup(
     version=0.1,
     description="Utilities for interacting with Weights and Biases and mlflow",
     zip_safe=False,  # avoid eggs, which make the handling of package data cumbersome
-    packages=["wandb_utils"],
+    packages=["wandb_utils", "data_utils", "model_utils", "resource_utils"],
     classifiers=[
         "Programming Language :: Python :: 3",
         "Development Status :: 4 - Beta",
     ],
+    # The libraries used by the step utilities (pandas, pyarrow, threadpoolctl...) are pinned in the
+    # environment of each step
     install_requires=[
         "mlflow",
         "wandb"
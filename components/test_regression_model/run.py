@@ -6,10 +6,12 @@ import argparse
 import logging
 import wandb
 import mlflow
-import pandas as pd
-from sklearn.metrics import mean_absolute_error
+from sklearn.metrics import mean_absolute_error, r2_score
 
 from wandb_utils.log_artifact import log_artifact
+from data_utils.read_dataset import read_dataset
+from model_utils.prediction_cache import PredictionCache
+from resource_utils.configure_resources import configure_resources
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
@@ -21,24 +23,42 @@ def go(args):
     run = wandb.init(job_type="test_model")
     run.config.update(args)
 
+    resources = configure_resources("test_regression_model")
+
     logger.info("Downloading artifacts")
     # Download input artifact. This will also log that this script is using this
     # particular version of the artifact
-    model_local_path = run.use_artifact(args.mlflow_model).download()
+    model_artifact = run.use_artifact(args.mlflow_model)
+    model_local_path = model_artifact.download()
 
     # Download test dataset
     test_dataset_path = run.use_artifact(args.test_dataset).file()
 
-    # Read test dataset
-    X_test = pd.read_csv(test_dataset_path)
-    y_test = X_test.pop("price")
-
     logger.info("Loading model and performing inference on test set")
     sk_pipe = mlflow.sklearn.load_model(model_local_path)
-    y_pred = sk_pipe.predict(X_test)
+    # The model keeps the number of jobs it was trained with
+    sk_pipe.set_params(random_forest__n_jobs=resources['n_jobs'])
+
+    # Read test dataset, only the columns used by the model
+    X_test = read_dataset(test_dataset_path, columns=list(sk_pipe.feature_names_in_) + ["price"])
+    y_test = X_test.pop("price")
+
+    if args.prediction_cache_size > 0:
+        # The artifact digest identifies the model content, whatever alias was used to fetch it
+        model = PredictionCache(
+            sk_pipe,
+            model_artifact.digest,
+            max_size=args.prediction_cache_size,
+            ttl=args.prediction_cache_ttl or None,
+            feature_columns=list(sk_pipe.feature_names_in_)
+        )
+    else:
+        model = sk_pipe
+
+    y_pred = model.predict(X_test)
 
     logger.info("Scoring")
-    r_squared = sk_pipe.score(X_test, y_test)
+    r_squared = r2_score(y_test, y_pred)
 
     mae = mean_absolute_error(y_test, y_pred)
 
@@ -49,6 +69,11 @@ def go(args):
     run.summary['r2'] = r_squared
     run.summary['mae'] = mae
 
+    if isinstance(model, PredictionCache):
+        cache_stats = model.stats()
+        logger.info(f"Prediction cache: {cache_stats}")
+        run.summary['prediction_cache'] = cache_stats
+
 
 if __name__ == "__main__":
 
@@ -68,6 +93,22 @@ if __name__ == "__main__":
         required=True
     )
 
+    parser.add_argument(
+        "--prediction_cache_size",
+        type=int,
+        help="Maximum number of predictions to memoize (0 disables the cache)",
+        default=0,
+        required=False
+    )
+
+    parser.add_argument(
+        "--prediction_cache_ttl",
+        type=float,
+        help="Time to live of the memoized predictions in seconds (0: no expiration)",
+        default=0,
+        required=False
+    )
+
     args = parser.parse_args()
 
     go(args)
@@ -4,11 +4,12 @@ This script splits the provided dataframe in test and remainder
 """
 import argparse
 import logging
-import pandas as pd
 import wandb
 import tempfile
 from sklearn.model_selection import train_test_split
 from wandb_utils.log_artifact import log_artifact
+from data_utils.read_dataset import read_dataset
+from resource_utils.configure_resources import configure_resources
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -19,12 +20,14 @@ def go(args):
     run = wandb.init(job_type="train_val_test_split")
     run.config.update(args)
 
+    configure_resources("data_split")
+
     # Download input artifact. This will also note that this script is using this
     # particular version of the artifact
     logger.info(f"Fetching artifact {args.input}")
     artifact_local_path = run.use_artifact(args.input).file()
 
-    df = pd.read_csv(artifact_local_path)
+    df = read_dataset(artifact_local_path)
 
     logger.info("Splitting trainval and test")
     trainval, test = train_test_split(
@@ -1,10 +1,19 @@
+import hashlib
 import json
+import logging
 import mlflow
 import tempfile
 import os
 import wandb
 import hydra
-from omegaconf import DictConfig
+from functools import partial
+from omegaconf import DictConfig, OmegaConf
+
+from pipeline_dag import PipelineDAG, Step, load_state, save_state
+from resource_utils.configure_resources import resource_environment
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
 
 _steps = [
     "download",
@@ -12,9 +21,220 @@ _steps = [
     "data_check",
     "data_split",
     "train_random_forest",
+    # "promote_model",
+    # "shadow_test",
     # "test_regression_model"
 ]
 
+
+def component_uri(config, root_path, name):
+    # The components are run from this repository, unless a remote one is configured
+    repository = config["main"]["components_repository"]
+    if "://" not in repository:
+        repository = os.path.join(root_path, repository)
+    return f"{repository}/{name}"
+
+
+def download(config, root_path):
+    _ = mlflow.run(
+        component_uri(config, root_path, "get_data"),
+        "main",
+        env_manager="conda",
+        parameters={
+            "sample": config["etl"]["sample"],
+            "artifact_name": "sample.csv",
+            "artifact_type": "raw_data",
+            "artifact_description": "Raw file as downloaded"
+        },
+    )
+
+
+def basic_cleaning(config, root_path):
+    _ = mlflow.run(
+        os.path.join(root_path, "src", "basic_cleaning"),
+        "main",
+        parameters={
+            "input_artifact": "sample.csv:latest",
+            "output_artifact": "clean_sample.csv",
+            "output_type": "clean_sample",
+            "output_description": "Data_with_outliers_and_null_values_removed",  # Use underscores instead of spaces
+            "min_price": float(config["etl"]["min_price"]),
+            "max_price": float(config["etl"]["max_price"])
+        },
+    )
+
+
+def data_check(config, root_path):
+    # Serialize the validation rules from config.yaml, resolving the interpolated thresholds
+    rules = os.path.abspath("data_check_rules.json")
+    with open(rules, "w") as fp:
+        json.dump(OmegaConf.to_container(config["data_check"]["rules"], resolve=True), fp)
+
+    _ = mlflow.run(
+        os.path.join(root_path, "src", "data_check"),
+        "validate",
+        parameters={
+            "csv": "clean_sample.csv:latest",
+            "ref": "clean_sample.csv:reference",
+            "rules": rules,
+            "quarantine": config["data_check"]["quarantine"],
+            "output_artifact": "clean_sample.csv",
+            "output_type": "clean_sample",
+            "quarantine_artifact": "quarantined_sample.csv",
+        },
+    )
+
+
+def data_split(config, root_path):
+    _ = mlflow.run(
+        component_uri(config, root_path, "train_val_test_split"),
+        "main",
+        parameters={
+            "input": "clean_sample.csv:latest",
+            "test_size": config["modeling"]["test_size"],
+            "random_seed": config["modeling"]["random_seed"],
+            "stratify_by": None if config["modeling"]["stratify_by"] == "none" else config["modeling"]["stratify_by"],
+        },
+    )
+
+
+def train_random_forest(config, root_path):
+    # Serialize Random Forest configuration from config.yaml in the working directory of the run
+    # (a temporary directory), so the source tree is never modified
+    rf_config = os.path.abspath("rf_config.json")
+    with open(rf_config, "w") as fp:
+        json.dump(dict(config["modeling"]["random_forest"]), fp)
+
+    _ = mlflow.run(
+        os.path.join(root_path, "src", "train_random_forest"),
+        "main",
+        parameters={
+            "trainval_artifact": "trainval_data.csv:latest",
+            "output_artifact": "random_forest_export",
+            "rf_config": rf_config,
+            "random_seed": config["modeling"]["random_seed"],
+            "val_size": config["modeling"]["val_size"],
+            "max_tfidf_features": config["modeling"]["max_tfidf_features"],
+            "n_neighbors": config["modeling"]["n_neighbors"],
+            "neighbourhood_price": config["modeling"]["neighbourhood_price"],
+            "verify_reproducibility": config["modeling"]["verify_reproducibility"],
+            "out_of_core": config["modeling"]["out_of_core"],
+            "max_samples": config["modeling"]["max_samples"],
+        },
+    )
+
+
+def promote_model(config, root_path, alias):
+    _ = mlflow.run(
+        os.path.join(root_path, "src", "promote_model"),
+        "main",
+        parameters={
+            "model_artifact": "random_forest_export",
+            "test_dataset": "test_data.csv:latest",
+            "top_n": config["promotion"]["top_n"],
+            "mae_tolerance": config["promotion"]["mae_tolerance"],
+            "latency_rows": config["promotion"]["latency_rows"],
+            "max_size_mb": config["promotion"]["max_size_mb"],
+            "alias": alias,
+        },
+    )
+
+
+def test_regression_model(config, root_path):
+    _ = mlflow.run(
+        component_uri(config, root_path, "test_regression_model"),
+        "main",
+        parameters={
+            "mlflow_model": "random_forest_export:prod",
+            "test_dataset": "test_data.csv:latest",
+            "prediction_cache_size": config["prediction_cache"]["size"],
+            "prediction_cache_ttl": config["prediction_cache"]["ttl"],
+        },
+    )
+
+
+def shadow_test(config, root_path):
+    _ = mlflow.run(
+        os.path.join(root_path, "src", "shadow_test"),
+        "main",
+        parameters={
+            "baseline_model": "random_forest_export:prod",
+            "candidate_model": f"random_forest_export:{config['shadow_test']['candidate_alias']}",
+            "request_log": config["shadow_test"]["request_log"],
+            "batch_sizes": config["shadow_test"]["batch_sizes"],
+            "max_latency_ratio": config["shadow_test"]["max_latency_ratio"],
+            "max_memory_ratio": config["shadow_test"]["max_memory_ratio"],
+            "release_alias": "prod",
+        },
+    )
+
+
+def get_pipeline_dag(config, root_path, active_steps):
+    """
+    Declare the pipeline steps with the artifacts each of them consumes and produces
+    """
+    # When the shadow test runs, the winner of the promotion only gets the prod alias if it passes it
+    promotion_alias = config["shadow_test"]["candidate_alias"] if "shadow_test" in active_steps else "prod"
+
+    return PipelineDAG([
+        Step("download", [], ["sample.csv"], partial(download, config, root_path)),
+        Step("basic_cleaning", ["sample.csv"], ["clean_sample.csv"], partial(basic_cleaning, config, root_path)),
+        Step(
+            "data_check",
+            ["clean_sample.csv"],
+            # "data_check_passed" is not an artifact: it only makes training wait for the validation,
+            # while the split can run at the same time. When quarantining, a new version of the clean
+            # data is also produced
+            ["data_check_passed"]
+            + (["clean_sample.csv", "quarantined_sample.csv"] if config["data_check"]["quarantine"] else []),
+            partial(data_check, config, root_path)
+        ),
+        Step(
+            "data_split",
+            ["clean_sample.csv"],
+            ["trainval_data.csv", "test_data.csv"],
+            partial(data_split, config, root_path)
+        ),
+        Step(
+            "train_random_forest",
+            ["trainval_data.csv", "data_check_passed"],
+            ["random_forest_export"],
+            partial(train_random_forest, config, root_path)
+        ),
+        Step(
+            "promote_model",
+            ["random_forest_export", "test_data.csv"],
+            # Moves the alias of the model
+            ["random_forest_export"],
+            partial(promote_model, config, root_path, promotion_alias)
+        ),
+        # Compares the winner of the promotion with the model in production, and moves the prod alias
+        # to it if it passes
+        Step(
+            "shadow_test",
+            ["random_forest_export"],
+            ["random_forest_export"],
+            partial(shadow_test, config, root_path)
+        ),
+        Step(
+            "test_regression_model",
+            ["random_forest_export", "test_data.csv"],
+            [],
+            partial(test_regression_model, config, root_path)
+        ),
+    ])
+
+
+def config_digest(config):
+    """
+    Hash of the resolved configuration, leaving out the settings that do not change the artifacts
+    """
+    resolved = OmegaConf.to_container(config, resolve=True)
+    for key in ["steps", "resume", "state_dir", "resources"]:
+        resolved["main"].pop(key, None)
+    return hashlib.sha256(json.dumps(resolved, sort_keys=True).encode()).hexdigest()
+
+
 @hydra.main(config_path=".", config_name='config')
 def go(config: DictConfig):
     # Setup the wandb experiment
@@ -25,99 +245,52 @@ def go(config: DictConfig):
     steps_par = config['main']['steps']
     active_steps = steps_par.split(",") if steps_par != "all" else _steps
 
+    root_path = hydra.utils.get_original_cwd()
+    dag = get_pipeline_dag(config, root_path, active_steps)
+
+    # Steps completed by a previous failed run are skipped when resuming
+    state_file = os.path.join(
+        os.path.expanduser(config["main"]["state_dir"]),
+        f"{config['main']['project_name']}_{config['main']['experiment_name']}.json"
+    )
+    digest = config_digest(config)
+    completed = set(load_state(state_file, digest)) if config["main"]["resume"] else set()
+
+    # Split the CPUs among the steps that can be running at the same time as each step, and pass the
+    # budget to the steps through the environment (inherited by the processes started by mlflow)
+    resources = config["main"]["resources"]
+    cpus = resources["cpus"] or os.cpu_count() or 1
+    max_parallel_steps = min(resources["max_parallel_steps"], cpus)
+    concurrency = dag.concurrency([name for name in active_steps if name not in completed], max_parallel_steps)
+    n_jobs = {name: max(1, cpus // n_steps) for name, n_steps in concurrency.items()}
+    logger.info(
+        f"Resources: {cpus} CPUs, up to {max_parallel_steps} steps at a time, workers of each step: {n_jobs}, "
+        f"with {resources['blas_threads']} OpenMP/BLAS threads per worker"
+    )
+    os.environ.update(resource_environment(n_jobs, resources["blas_threads"], resources["joblib_backend"]))
+
+    def on_success(name):
+        completed.add(name)
+        save_state(state_file, completed, digest)
+
     # Use a temporary directory
     with tempfile.TemporaryDirectory() as tmp_dir:
         os.chdir(tmp_dir)
 
-        if "download" in active_steps:
-            # Download file using the remote repository
-            _ = mlflow.run(
-                f"{config['main']['components_repository']}/get_data",
-                "main",
-                version='main',
-                env_manager="conda",
-                parameters={
-                    "sample": config["etl"]["sample"],
-                    "artifact_name": "sample.csv",
-                    "artifact_type": "raw_data",
-                    "artifact_description": "Raw file as downloaded"
-                },
-            )
-
-        if "basic_cleaning" in active_steps:
-            # Define the root path
-            root_path = hydra.utils.get_original_cwd()
-            _ = mlflow.run(
-                os.path.join(root_path, "src", "basic_cleaning"),
-                "main",
-                parameters={
-                    "input_artifact": "sample.csv:latest",
-                    "output_artifact": "clean_sample.csv",
-                    "output_type": "clean_sample",
-                    "output_description": "Data_with_outliers_and_null_values_removed",  # Use underscores instead of spaces
-                    "min_price": float(config["etl"]["min_price"]),
-                    "max_price": float(config["etl"]["max_price"])
-                },
-            )
-
-        # Placeholder for other steps
-        if "data_check" in active_steps:
-            # Define the root path for execution
-            root_path = hydra.utils.get_original_cwd()
-            _ = mlflow.run(
-                os.path.join(root_path, "src", "data_check"),
-                "main",
-                parameters={
-                    "csv": "clean_sample.csv:latest",
-                    "ref": "clean_sample.csv:reference",
-                    "kl_threshold": config["data_check"]["kl_threshold"],
-                    "min_price": float(config["etl"]["min_price"]),
-                    "max_price": float(config["etl"]["max_price"]),
-                },
-            )
-
-
-        if "data_split" in active_steps:
-            _ = mlflow.run(
-                f"{config['main']['components_repository']}/train_val_test_split",
-                "main",
-                parameters={
-                    "input": "clean_sample.csv:latest",
-                    "test_size": config["modeling"]["test_size"],
-                    "random_seed": config["modeling"]["random_seed"],
-                    "stratify_by": None if config["modeling"]["stratify_by"] == "none" else config["modeling"]["stratify_by"],
-
-                },
-            )
-
-
-        if "train_random_forest" in active_steps:
-            root_path = hydra.utils.get_original_cwd()  
-        
-            # Serialize Random Forest configuration from config.yaml
-            rf_config = os.path.join(root_path, "rf_config.json")
-            with open(rf_config, "w") as fp:
-                json.dump(dict(config["modeling"]["random_forest"]), fp)
-        
-            _ = mlflow.run(
-                os.path.join(root_path, "src", "train_random_forest"),
-                "main",
-                parameters={
-                    "trainval_artifact": "trainval_data.csv:latest",
-                    "output_artifact": "random_forest_export",
-                    "rf_config": rf_config,
-                    "random_seed": config["modeling"]["random_seed"],
-                    "val_size": config["modeling"]["val_size"],  
-                    "max_tfidf_features": config["modeling"]["max_tfidf_features"],  
-                },
-            )
-
-
-
-
-
-        if "test_regression_model" in active_steps:
-            pass
+        durations = dag.run(
+            active_steps,
+            max_workers=max_parallel_steps,
+            completed=completed,
+            on_success=on_success
+        )
+
+    # The whole pipeline succeeded, so the next run starts from scratch
+    if os.path.exists(state_file):
+        os.remove(state_file)
+
+    path, total = dag.critical_path(durations)
+    logger.info(f"Critical path: {' -> '.join(path)} ({total:.1f} s)")
+
 
 if __name__ == "__main__":
-    go()
\ No newline at end of file
+    go()
@@ -0,0 +1,187 @@
+"""
+Declarative step DAG for the pipeline, with a scheduler that runs independent steps concurrently
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+logger = logging.getLogger(__name__)
+
+
+# A pipeline step: the artifacts it reads and writes, and a callable that runs it
+Step = namedtuple("Step", ["name", "inputs", "outputs", "run"])
+
+
+class StepFailed(RuntimeError):
+    pass
+
+
+class PipelineDAG:
+    """
+    Dependency graph derived from the artifacts each step consumes and produces. A step depends
+    on every step declared before it that produces one of its inputs, so declaration order
+    resolves artifacts that are re-versioned by more than one step.
+    """
+
+    def __init__(self, steps):
+        self.steps = {step.name: step for step in steps}
+        self.order = [step.name for step in steps]
+
+        self.dependencies = {}
+        for i, step in enumerate(steps):
+            self.dependencies[step.name] = {
+                other.name for other in steps[:i] if set(other.outputs) & set(step.inputs)
+            }
+
+    def upstream(self, name, active):
+        """
+        Return the active steps that ``name`` must wait for. Inactive steps are skipped
+        transparently, i.e. their outputs are assumed to be available already in W&B
+        """
+        deps = set()
+        for dep in self.dependencies[name]:
+            if dep in active:
+                deps.add(dep)
+            else:
+                deps |= self.upstream(dep, active)
+        return deps
+
+    def concurrency(self, active_steps, max_workers=1):
+        """
+        Return, for each active step, the maximum number of steps that can be running while it runs
+        (itself included): the steps that are neither upstream nor downstream of it, up to max_workers
+        """
+        active = [name for name in self.order if name in active_steps]
+
+        # Steps are declared in dependency order, so the ancestors of the upstream steps are known
+        ancestors = {}
+        for name in active:
+            upstream = self.upstream(name, set(active))
+            ancestors[name] = upstream.union(*(ancestors[dep] for dep in upstream))
+
+        return {
+            name: min(max(1, max_workers), 1 + sum(
+                other != name and other not in ancestors[name] and name not in ancestors[other]
+                for other in active
+            ))
+            for name in active
+        }
+
+    def run(self, active_steps, max_workers=1, completed=(), on_success=None):
+        """
+        Run the active steps, launching each one as soon as all of its upstream steps have
+        succeeded. Steps in ``completed`` are considered done and are not executed again.
+
+        :param active_steps: names of the steps to execute
+        :param max_workers: maximum number of steps running at the same time
+        :param completed: steps already completed by a previous (failed) run
+        :param on_success: callback invoked with the step name after each successful step
+        :return: dictionary mapping each executed step to its duration in seconds
+        """
+        unknown = set(active_steps) - set(self.steps)
+        if unknown:
+            raise ValueError(f"Unknown steps: {', '.join(sorted(unknown))}")
+
+        active = [name for name in self.order if name in active_steps]
+        upstream = {name: self.upstream(name, set(active)) for name in active}
+
+        done = set(completed) & set(active)
+        for name in done:
+            logger.info(f"Skipping step {name}: already completed")
+
+        pending = [name for name in active if name not in done]
+        failed = set()
+        durations = {}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            while pending or running:
+                # Steps downstream of a failure can never run
+                for name in list(pending):
+                    if upstream[name] & failed:
+                        logger.error(f"Skipping step {name}: an upstream step failed")
+                        pending.remove(name)
+                        failed.add(name)
+
+                for name in list(pending):
+                    if upstream[name] <= done:
+                        logger.info(f"Starting step {name}")
+                        pending.remove(name)
+                        running[executor.submit(self._timed, self.steps[name])] = name
+
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        durations[name] = future.result()
+                    except Exception:
+                        logger.exception(f"Step {name} failed")
+                        failed.add(name)
+                    else:
+                        logger.info(f"Step {name} completed in {durations[name]:.1f} s")
+                        done.add(name)
+                        if on_success is not None:
+                            on_success(name)
+
+        if failed:
+            raise StepFailed(f"Failed steps: {', '.join(n for n in active if n in failed)}")
+
+        return durations
+
+    def critical_path(self, durations):
+        """
+        Return the chain of dependent steps with the largest total duration, and that duration
+        """
+        active = set(durations)
+        best = {}
+        for name in self.order:
+            if name not in active:
+                continue
+            prev = max(
+                (best[dep] for dep in self.upstream(name, active)),
+                key=lambda item: item[1],
+                default=([], 0.0)
+            )
+            best[name] = (prev[0] + [name], prev[1] + durations[name])
+
+        return max(best.values(), key=lambda item: item[1], default=([], 0.0))
+
+    @staticmethod
+    def _timed(step):
+        start = time.perf_counter()
+        step.run()
+        return time.perf_counter() - start
+
+
+def load_state(state_file, config_digest=None):
+    """
+    Return the steps completed by the previous run recorded in ``state_file`` (if any). The state is
+    ignored if that run used a different configuration, since its artifacts would be stale
+    """
+    if not os.path.exists(state_file):
+        return []
+
+    with open(state_file) as fp:
+        state = json.load(fp)
+
+    if state.get("config_digest") != config_digest:
+        logger.warning(f"Ignoring {state_file}: the configuration changed since the previous run")
+        return []
+
+    return state.get("completed", [])
+
+
+def save_state(state_file, completed, config_digest=None):
+    """
+    Record the steps completed so far and the digest of the configuration, so a failed run can be resumed
+    """
+    os.makedirs(os.path.dirname(state_file) or ".", exist_ok=True)
+    with open(state_file, "w") as fp:
+        json.dump({"completed": sorted(completed), "config_digest": config_digest}, fp)
@@ -7,6 +7,9 @@ import logging
 import wandb
 import pandas as pd
 
+from data_utils.read_dataset import read_dataset
+from resource_utils.configure_resources import configure_resources
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
@@ -19,9 +22,11 @@ def go(args):
     )
     run.config.update(args)
 
+    configure_resources("basic_cleaning")
+
     logger.info(f"Downloading artifact: {args.input_artifact}")
     artifact_local_path = run.use_artifact(args.input_artifact).file()
-    df = pd.read_csv(artifact_local_path)
+    df = read_dataset(artifact_local_path)
     
     logger.info("Dropping outliers based on price range")
     df = df[df['price'].between(args.min_price, args.max_price)].copy()
@@ -1,7 +1,10 @@
+import json
 import pytest
-import pandas as pd
 import wandb
 
+from data_utils.read_dataset import read_dataset
+from validation import validate, default_rules
+
 
 def pytest_addoption(parser):
     parser.addoption("--csv", action="store")
@@ -9,6 +12,25 @@ def pytest_addoption(parser):
     parser.addoption("--kl_threshold", action="store")
     parser.addoption("--min_price", action="store")
     parser.addoption("--max_price", action="store")
+    parser.addoption("--rules", action="store")
+
+
+def load_rules(config):
+    """
+    Rules from the JSON file passed with --rules (if any)
+    """
+    if not config.option.rules:
+        return None
+
+    with open(config.option.rules) as fp:
+        return json.load(fp)
+
+
+def pytest_generate_tests(metafunc):
+    # Only the names are needed here, so the thresholds of the default rules do not matter
+    if "rule_name" in metafunc.fixturenames:
+        rules = load_rules(metafunc.config) or default_rules(0, 0, 0)
+        metafunc.parametrize("rule_name", [rule["name"] for rule in rules])
 
 
 @pytest.fixture(scope='session')
@@ -22,7 +44,7 @@ def data(request):
     if data_path is None:
         pytest.fail("You must provide the --csv option on the command line")
 
-    df = pd.read_csv(data_path)
+    df = read_dataset(data_path)
 
     return df
 
@@ -38,7 +60,7 @@ def ref_data(request):
     if data_path is None:
         pytest.fail("You must provide the --ref option on the command line")
 
-    df = pd.read_csv(data_path)
+    df = read_dataset(data_path)
 
     return df
 
@@ -69,3 +91,23 @@ def max_price(request):
         pytest.fail("You must provide max_price")
 
     return float(max_price)
+
+
+@pytest.fixture(scope='session')
+def rules(request):
+    rules = load_rules(request.config)
+
+    if rules is None:
+        rules = default_rules(
+            request.getfixturevalue("kl_threshold"),
+            request.getfixturevalue("min_price"),
+            request.getfixturevalue("max_price")
+        )
+
+    return rules
+
+
+@pytest.fixture(scope='session')
+def report(data, ref_data, rules):
+    report, _ = validate(data, rules, ref_data)
+    return report
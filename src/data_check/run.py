@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Validate a dataset against the configured rules in a single pass, optionally quarantining the invalid rows
+"""
+import argparse
+import json
+import logging
+import wandb
+
+from data_utils.read_dataset import read_dataset
+from resource_utils.configure_resources import configure_resources
+from validation import validate, summarize
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def go(args):
+
+    run = wandb.init(job_type="data_check")
+    run.config.update(args)
+
+    configure_resources("data_check")
+
+    with open(args.rules) as fp:
+        rules = json.load(fp)
+
+    logger.info(f"Downloading artifacts {args.csv} and {args.ref}")
+    df = read_dataset(run.use_artifact(args.csv).file())
+    ref = read_dataset(run.use_artifact(args.ref).file())
+
+    logger.info(f"Validating {df.shape[0]} rows against {len(rules)} rules")
+    report, invalid_rows = validate(df, rules, ref)
+
+    summary = summarize(report)
+    for _, result in summary.iterrows():
+        log = logger.info if result["passed"] else logger.error
+        log(f"{'PASSED' if result['passed'] else 'FAILED'} {result['rule']}: "
+            f"{result['n_violations']} violations ({result['message']})")
+
+    run.summary["validation"] = report
+    run.log({"validation_report": wandb.Table(dataframe=summary.astype(str))})
+
+    # Dataset-level rules (schema, row count, drift...) cannot be fixed by removing rows
+    failed = summary[~summary["passed"]]
+    if args.quarantine and failed["row_level"].all() and report["n_invalid_rows"] > 0:
+        logger.info(f"Quarantining {report['n_invalid_rows']} invalid rows")
+        clean = df[~invalid_rows]
+
+        # Removing rows can break the dataset-level rules (row count, drift...), so what is left is
+        # validated again
+        clean_report, _ = validate(clean, rules, ref)
+        run.summary["validation_after_quarantine"] = clean_report
+        if not clean_report["passed"]:
+            failed_rules = [name for name, result in clean_report["rules"].items() if not result["passed"]]
+            run.finish(exit_code=1)
+            raise ValueError(f"Data validation failed after quarantine for rules: {', '.join(failed_rules)}")
+
+        for name, rows, description in [
+            (args.output_artifact, clean, "Data that passed validation"),
+            (args.quarantine_artifact, df[invalid_rows], "Rows that failed validation"),
+        ]:
+            rows.to_csv(name, index=False)
+            artifact = wandb.Artifact(name, type=args.output_type, description=description)
+            artifact.add_file(name)
+            run.log_artifact(artifact)
+
+    elif not report["passed"]:
+        run.finish(exit_code=1)
+        raise ValueError(f"Data validation failed for rules: {', '.join(failed['rule'])}")
+
+    run.finish()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate a dataset against a set of rules")
+
+    parser.add_argument("--csv", type=str, help="Input CSV artifact to validate", required=True)
+    parser.add_argument("--ref", type=str, help="Reference CSV artifact for the drift rules", required=True)
+    parser.add_argument("--rules", type=str, help="Path to a JSON file with the list of rules", required=True)
+    parser.add_argument(
+        "--quarantine",
+        type=lambda s: s.lower() in ("true", "1", "yes"),
+        help="Remove the rows violating row-level rules instead of failing",
+        default=False
+    )
+    parser.add_argument("--output_artifact", type=str, help="Name for the validated data artifact", required=True)
+    parser.add_argument("--output_type", type=str, help="Type of the output artifacts", required=True)
+    parser.add_argument(
+        "--quarantine_artifact", type=str, help="Name for the artifact with the quarantined rows", required=True
+    )
+
+    args = parser.parse_args()
+    go(args)
@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from validation import validate, default_rules, summarize
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        "id": [1, 2, 3, 4, 5, 6],
+        "neighbourhood_group": ["Bronx", "Brooklyn", "Manhattan", "Queens", "Staten Island", "Manhattan"],
+        "price": [50.0, 80.0, 120.0, 90.0, 60.0, 200.0],
+    })
+
+
+RULES = [
+    {"name": "groups", "type": "categories", "column": "neighbourhood_group",
+     "values": ["Bronx", "Brooklyn", "Manhattan", "Queens", "Staten Island"]},
+    {"name": "price_range", "type": "range", "column": "price", "min": 10, "max": 350},
+    {"name": "unique_id", "type": "unique", "column": "id"},
+    {"name": "row_count", "type": "row_count", "min": 3, "max": 100},
+]
+
+
+def test_valid(df):
+    report, invalid_rows = validate(df, RULES)
+
+    assert report["passed"]
+    assert not invalid_rows.any()
+    assert list(summarize(report)["rule"]) == [rule["name"] for rule in RULES]
+
+
+def test_all_violations_are_reported(df):
+    df.loc[0, "price"] = 1000
+    df.loc[1, "id"] = 1
+    df.loc[2, "neighbourhood_group"] = "Narnia"
+
+    report, invalid_rows = validate(df, RULES)
+
+    assert not report["passed"]
+    assert [name for name, result in report["rules"].items() if not result["passed"]] == [
+        "groups", "price_range", "unique_id"
+    ]
+    np.testing.assert_array_equal(invalid_rows, [True, True, True, False, False, False])
+    assert report["n_invalid_rows"] == 3
+
+
+def test_row_level_failures_can_be_quarantined(df):
+    df.loc[5, "price"] = 1000
+
+    report, invalid_rows = validate(df, RULES)
+
+    assert report["rules"]["price_range"]["row_level"]
+    assert validate(df[~invalid_rows], RULES)[0]["passed"]
+
+
+def test_quarantine_can_break_other_rules(df):
+    # The only listing in the Bronx is invalid: without it the categories rule fails
+    df.loc[0, "price"] = 1000
+
+    report, invalid_rows = validate(df, RULES)
+    clean_report, _ = validate(df[~invalid_rows], RULES)
+
+    assert report["rules"]["groups"]["passed"]
+    assert not clean_report["rules"]["groups"]["passed"]
+
+
+def test_absent_category_is_dataset_level(df):
+    # Removing rows can never bring back the Bronx, so the rows of the other failures do not help
+    df = df[df["neighbourhood_group"] != "Bronx"]
+    df.loc[1, "price"] = 1000
+
+    report, invalid_rows = validate(df, RULES)
+
+    assert not report["rules"]["groups"]["passed"]
+    assert not report["rules"]["groups"]["row_level"]
+    assert "Bronx" in report["rules"]["groups"]["message"]
+    assert report["rules"]["price_range"]["row_level"]
+    assert invalid_rows.sum() == 1
+
+
+def test_categories_not_exact(df):
+    rules = [{**RULES[0], "exact": False}]
+
+    report, _ = validate(df[df["neighbourhood_group"] != "Bronx"], rules)
+
+    assert report["passed"]
+
+
+def test_dataset_level_rules(df):
+    report, invalid_rows = validate(df.iloc[:2], RULES)
+
+    assert not report["rules"]["row_count"]["passed"]
+    assert not report["rules"]["row_count"]["row_level"]
+    assert not invalid_rows.any()
+
+
+def test_schema():
+    rule = {"name": "columns", "type": "schema", "columns": ["a", "b", "c"]}
+
+    assert validate(pd.DataFrame(columns=["a", "b", "c"]), [rule])[0]["passed"]
+    assert "order" in validate(pd.DataFrame(columns=["a", "c", "b"]), [rule])[0]["rules"]["columns"]["message"]
+    assert validate(pd.DataFrame(columns=["a", "b"]), [rule])[0]["rules"]["columns"]["n_violations"] == 1
+
+
+def test_drift(df):
+    rule = {"name": "drift", "type": "drift", "column": "neighbourhood_group", "threshold": 0.1}
+
+    assert validate(df, [rule], ref=df)[0]["passed"]
+    shifted = df.assign(neighbourhood_group="Manhattan")
+    assert not validate(shifted, [rule], ref=df)[0]["passed"]
+    with pytest.raises(ValueError, match="requires a reference"):
+        validate(df, [rule])
+
+
+def test_missing_column(df):
+    report, _ = validate(df.drop(columns="price"), RULES)
+
+    assert report["rules"]["price_range"]["message"] == "missing column price"
+    assert not report["rules"]["price_range"]["passed"]
+
+
+def test_invalid_rules(df):
+    with pytest.raises(ValueError, match="unique"):
+        validate(df, RULES + RULES[:1])
+    with pytest.raises(ValueError, match="Unknown type"):
+        validate(df, [{"name": "x", "type": "nope"}])
+
+
+def test_default_rules_are_valid():
+    names = [rule["name"] for rule in default_rules(0.1, 10, 350)]
+
+    assert len(set(names)) == len(names)
@@ -0,0 +1,185 @@
+"""
+Declarative data validation: evaluate a list of rules on a DataFrame and report all the violations
+"""
+import numpy as np
+import pandas as pd
+import scipy.stats
+
+
+def check_schema(df, rule, ref):
+    # This also enforces the same order
+    expected = list(rule["columns"])
+    actual = list(df.columns)
+    n_wrong = len(set(expected) ^ set(actual))
+    if n_wrong == 0 and expected != actual:
+        message = "columns are not in the expected order"
+        n_wrong = sum(a != b for a, b in zip(expected, actual))
+    else:
+        message = f"missing: {sorted(set(expected) - set(actual))}, unexpected: {sorted(set(actual) - set(expected))}"
+    return n_wrong, None, message
+
+
+def check_range(df, rule, ref):
+    values = df[rule["column"]]
+    rows = ~values.between(rule.get("min", -np.inf), rule.get("max", np.inf))
+    return int(rows.sum()), rows.to_numpy(), f"{rule['column']} outside [{rule.get('min')}, {rule.get('max')}]"
+
+
+def check_categories(df, rule, ref):
+    values = df[rule["column"]]
+    known = set(rule["values"])
+    rows = values.notna() & ~values.isin(known)
+    n_wrong = int(rows.sum())
+    message = f"unknown values: {sorted(map(str, values[rows].unique()))}"
+
+    # Unless exact is set to false, every category must also be present
+    if rule.get("exact", True):
+        absent = known - set(values.dropna().unique())
+        message += f", absent values: {sorted(absent)}"
+        if absent:
+            # Removing rows cannot bring a category back, so the failure is dataset-level
+            return n_wrong + len(absent), None, message
+
+    return n_wrong, rows.to_numpy(), message
+
+
+def check_not_null(df, rule, ref):
+    rows = df[rule["column"]].isna()
+    return int(rows.sum()), rows.to_numpy(), f"null values in {rule['column']}"
+
+
+def check_unique(df, rule, ref):
+    # The first occurrence of each value is considered valid
+    rows = df[rule["column"]].duplicated(keep="first")
+    return int(rows.sum()), rows.to_numpy(), f"duplicated values in {rule['column']}"
+
+
+def check_row_count(df, rule, ref):
+    n_rows = df.shape[0]
+    ok = rule.get("min", 0) < n_rows < rule.get("max", np.inf)
+    return int(not ok), None, f"{n_rows} rows, expected between {rule.get('min')} and {rule.get('max')}"
+
+
+def check_drift(df, rule, ref):
+    """
+    Apply a threshold on the KL divergence to detect if the distribution of the new data is
+    significantly different than that of the reference dataset
+    """
+    if ref is None:
+        raise ValueError(f"Rule {rule['name']} requires a reference dataset")
+
+    dist1 = df[rule["column"]].astype(object).value_counts()
+    dist2 = ref[rule["column"]].astype(object).value_counts()
+    dist1, dist2 = dist1.align(dist2, fill_value=0)
+
+    kl = scipy.stats.entropy(dist1, dist2, base=2)
+    return int(not kl < rule["threshold"]), None, f"KL divergence {kl:.4f} (threshold {rule['threshold']})"
+
+
+CHECKS = {
+    "schema": check_schema,
+    "range": check_range,
+    "categories": check_categories,
+    "not_null": check_not_null,
+    "unique": check_unique,
+    "row_count": check_row_count,
+    "drift": check_drift,
+}
+
+
+def validate(df, rules, ref=None):
+    """
+    Evaluate all the rules on df, without stopping at the first failure
+
+    :param df: DataFrame to validate
+    :param rules: list of rules. Each rule is a dictionary with a unique ``name``, a ``type`` among
+                  the keys of CHECKS and the parameters of that type of rule
+    :param ref: reference DataFrame, needed by the drift rules
+    :return: a tuple (report, invalid_rows). The report is a JSON-serializable dictionary with the
+             result of each rule, invalid_rows a boolean array flagging the rows violating at least
+             one row-level rule (range, categories, not_null, unique)
+    """
+    names = [rule["name"] for rule in rules]
+    if len(set(names)) != len(names):
+        raise ValueError("Rule names must be unique")
+
+    invalid_rows = np.zeros(df.shape[0], dtype=bool)
+    results = {}
+    for rule in rules:
+        if rule["type"] not in CHECKS:
+            raise ValueError(f"Unknown type {rule['type']} for rule {rule['name']}")
+
+        columns = [rule["column"]] if "column" in rule else []
+        missing = [col for col in columns if col not in df.columns]
+        if missing:
+            n_wrong, rows, message = 1, None, f"missing column {missing[0]}"
+        else:
+            n_wrong, rows, message = CHECKS[rule["type"]](df, rule, ref)
+
+        if rows is not None:
+            invalid_rows |= rows
+
+        results[rule["name"]] = {
+            "type": rule["type"],
+            "passed": n_wrong == 0,
+            "row_level": rows is not None,
+            "n_violations": n_wrong,
+            "message": message,
+        }
+
+    report = {
+        "passed": all(result["passed"] for result in results.values()),
+        "n_rows": int(df.shape[0]),
+        "n_invalid_rows": int(invalid_rows.sum()),
+        "rules": results,
+    }
+
+    return report, invalid_rows
+
+
+def default_rules(kl_threshold, min_price, max_price):
+    """
+    Rules equivalent to the original data tests, for when no rules are configured
+    """
+    return [
+        {
+            "name": "column_names",
+            "type": "schema",
+            "columns": [
+                "id",
+                "name",
+                "host_id",
+                "host_name",
+                "neighbourhood_group",
+                "neighbourhood",
+                "latitude",
+                "longitude",
+                "room_type",
+                "price",
+                "minimum_nights",
+                "number_of_reviews",
+                "last_review",
+                "reviews_per_month",
+                "calculated_host_listings_count",
+                "availability_365",
+            ],
+        },
+        {
+            "name": "neighborhood_names",
+            "type": "categories",
+            "column": "neighbourhood_group",
+            "values": ["Bronx", "Brooklyn", "Manhattan", "Queens", "Staten Island"],
+        },
+        {"name": "proper_longitude", "type": "range", "column": "longitude", "min": -74.25, "max": -73.50},
+        {"name": "proper_latitude", "type": "range", "column": "latitude", "min": 40.5, "max": 41.2},
+        {"name": "similar_neigh_distrib", "type": "drift", "column": "neighbourhood_group", "threshold": kl_threshold},
+        {"name": "row_count", "type": "row_count", "min": 15000, "max": 1000000},
+        {"name": "price_range", "type": "range", "column": "price", "min": min_price, "max": max_price},
+    ]
+
+
+def summarize(report):
+    """
+    Return a DataFrame with one row per rule, for logging
+    """
+    return pd.DataFrame.from_dict(report["rules"], orient="index").rename_axis("rule").reset_index()
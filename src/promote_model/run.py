@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+"""
+Evaluate the best candidate models on the test set in parallel, and give an alias ("prod" by default) to
+the one with the best trade-off between accuracy and inference cost (latency and size)
+"""
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mlflow
+import numpy as np
+import pandas as pd
+import wandb
+from mlflow.models import Model
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from data_utils.read_dataset import read_dataset
+from resource_utils.configure_resources import configure_resources
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def go(args):
+
+    run = wandb.init(job_type="promote_model")
+    run.config.update(args)
+
+    resources = configure_resources("promote_model")
+
+    api = wandb.Api()
+    versions = api.artifacts("model_export", f"{run.entity}/{run.project}/{args.model_artifact}")
+
+    # Rank the candidates by the validation MAE of the run that produced them
+    candidates = []
+    for artifact in versions:
+        mae = artifact.logged_by().summary.get("mae")
+        if mae is None:
+            logger.warning(f"Skipping {artifact.name}: no validation MAE")
+            continue
+        candidates.append((mae, artifact.name))
+
+    candidates = [name for _, name in sorted(candidates)[:args.top_n]]
+    if not candidates:
+        raise ValueError(f"No candidates found for {args.model_artifact}")
+    logger.info(f"Evaluating {', '.join(candidates)}")
+
+    # Download everything from this thread, so the lineage is recorded in the run
+    model_paths = {name: run.use_artifact(name).download() for name in candidates}
+
+    # The test data is loaded once and shared by all the workers, reading only the columns used by
+    # the candidates (from the signature saved with each model, when there is one)
+    schemas = [Model.load(path).get_input_schema() for path in model_paths.values()]
+    columns = None
+    if all(schema is not None for schema in schemas):
+        columns = sorted({"price"}.union(*(schema.input_names() for schema in schemas)))
+    X_test = read_dataset(run.use_artifact(args.test_dataset).file(), columns=columns)
+    y_test = X_test.pop("price")
+
+    # Threads share the test data without copying it, but only the tree traversal of the random
+    # forest releases the GIL: unpickling and the preprocessing (pandas, TF-IDF, encoders) hold it,
+    # so those parts of the candidates run one at a time. The speedup is logged below.
+    # The workers of this step are split among the candidates
+    n_workers = min(len(candidates), resources["n_jobs"])
+    n_jobs = max(1, resources["n_jobs"] // n_workers)
+    logger.info(f"Evaluating {n_workers} candidates at a time with {n_jobs} jobs each")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(
+            lambda name: evaluate(name, model_paths[name], X_test, y_test, n_jobs),
+            candidates
+        ))
+    elapsed = time.perf_counter() - start
+    # Each time includes the waits for the GIL, so this is an upper bound of the actual speedup
+    busy = sum(result["load_s"] + result["score_s"] for result in results)
+    logger.info(
+        f"Evaluated the candidates in {elapsed:.1f}s, at most {busy / elapsed:.2f}x faster than one at a time"
+    )
+    run.summary["evaluation_s"] = elapsed
+
+    # Latency is measured one candidate at a time, so the candidates do not slow each other down
+    rows = X_test.iloc[:args.latency_rows]
+    for result in results:
+        model = result.pop("model")
+        model.set_params(random_forest__n_jobs=resources["n_jobs"])
+        result.update(measure_latency(model, rows))
+
+    report = pd.DataFrame(results).set_index("candidate")
+    logger.info(f"Candidates:\n{report.to_string()}")
+
+    # Among the candidates that fit the size limit and are within the tolerance from the best MAE,
+    # pick the fastest, then the smallest
+    eligible = report
+    if args.max_size_mb > 0:
+        eligible = eligible[eligible["size_mb"] <= args.max_size_mb]
+        if eligible.empty:
+            raise ValueError(f"No candidate is smaller than {args.max_size_mb} MB")
+    eligible = eligible[eligible["mae"] <= eligible["mae"].min() * (1 + args.mae_tolerance)]
+    winner = eligible.sort_values(["latency_p95_ms", "size_mb", "mae"]).index[0]
+    logger.info(f"Promoting {winner} to {args.alias}")
+
+    artifact = api.artifact(f"{run.entity}/{run.project}/{winner}")
+    if args.alias not in artifact.aliases:
+        # Aliases are unique within an artifact collection, so this also removes it from the old model
+        artifact.aliases.append(args.alias)
+        artifact.save()
+
+    run.summary["winner"] = winner
+    run.log({"candidates": wandb.Table(dataframe=report.reset_index())})
+
+
+def evaluate(name, model_local_path, X_test, y_test, n_jobs):
+    """
+    Load a candidate model and score it on the test set
+    """
+    start = time.perf_counter()
+    sk_pipe = mlflow.sklearn.load_model(model_local_path)
+    sk_pipe.set_params(random_forest__n_jobs=n_jobs)
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = sk_pipe.predict(X_test)
+    score_s = time.perf_counter() - start
+
+    logger.info(f"Scored {name}")
+    return {
+        "candidate": name,
+        "model": sk_pipe,
+        "mae": mean_absolute_error(y_test, y_pred),
+        "r2": r2_score(y_test, y_pred),
+        "batch_rows_per_s": len(X_test) / score_s,
+        "load_s": load_s,
+        "score_s": score_s,
+        "size_mb": directory_size(model_local_path) / 2**20,
+    }
+
+
+def measure_latency(sk_pipe, rows):
+    """
+    Predict the rows one at a time and return the latency percentiles in milliseconds
+    """
+    latencies = []
+    for i in range(len(rows)):
+        start = time.perf_counter()
+        sk_pipe.predict(rows.iloc[i:i + 1])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "latency_p50_ms": np.percentile(latencies, 50),
+        "latency_p95_ms": np.percentile(latencies, 95),
+    }
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, filename))
+        for root, _, filenames in os.walk(path)
+        for filename in filenames
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Evaluate the candidate models and promote the best one")
+
+    parser.add_argument(
+        "--model_artifact",
+        type=str,
+        help="Name of the model artifact whose versions are the candidates",
+        required=True
+    )
+
+    parser.add_argument(
+        "--test_dataset",
+        type=str,
+        help="Test dataset",
+        required=True
+    )
+
+    parser.add_argument(
+        "--top_n",
+        type=int,
+        help="Number of candidates (the ones with the best validation MAE) to evaluate",
+        default=3
+    )
+
+    parser.add_argument(
+        "--mae_tolerance",
+        type=float,
+        help="Relative MAE degradation with respect to the most accurate candidate that is accepted "
+        "in exchange for a faster model",
+        default=0.02
+    )
+
+    parser.add_argument(
+        "--latency_rows",
+        type=int,
+        help="Number of test rows predicted one at a time to measure the latency",
+        default=100
+    )
+
+    parser.add_argument(
+        "--max_size_mb",
+        type=float,
+        help="Maximum size of the promoted model in MB (0: no limit)",
+        default=0
+    )
+
+    parser.add_argument(
+        "--alias",
+        type=str,
+        help="Alias given to the winner",
+        default="prod"
+    )
+
+    args = parser.parse_args()
+
+    go(args)
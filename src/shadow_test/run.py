@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Replay a log of recorded requests against the production model and a candidate loaded side by side,
+comparing latency, throughput, memory and predictions. Fails if the candidate is too slow or too large,
+otherwise releases it to production
+"""
+import argparse
+import logging
+import pickle
+import resource
+import time
+
+import mlflow
+import numpy as np
+import pandas as pd
+import wandb
+from sklearn.metrics import mean_absolute_error
+
+from resource_utils.configure_resources import configure_resources
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
+logger = logging.getLogger()
+
+
+def go(args):
+
+    run = wandb.init(job_type="shadow_test")
+    run.config.update(args)
+
+    resources = configure_resources("shadow_test")
+
+    logger.info(f"Downloading the request log {args.request_log}")
+    requests = pd.read_json(run.use_artifact(args.request_log).file(), lines=True)
+    # Recorded requests may come with the observed price, which allows to compare the accuracy too
+    y_true = requests.pop("price") if "price" in requests.columns else None
+    logger.info(f"Replaying {len(requests)} requests")
+
+    # The models are loaded side by side. The memory of each one is measured as its pickled size: the
+    # memory added to the process by loading it would also count the modules imported by the first load
+    models = {}
+    memory = {}
+    for role, name in [("baseline", args.baseline_model), ("candidate", args.candidate_model)]:
+        try:
+            model_local_path = run.use_artifact(name).download()
+        except wandb.errors.CommError:
+            if role == "candidate":
+                raise
+            # First release: there is no production model to compare with
+            logger.warning(f"Baseline model {name} not found, the candidate is released without comparison")
+            continue
+        models[role] = mlflow.sklearn.load_model(model_local_path)
+        # Both models are measured with the same number of jobs, whatever they were trained with
+        models[role].set_params(random_forest__n_jobs=resources["n_jobs"])
+        memory[role] = len(pickle.dumps(models[role], protocol=pickle.HIGHEST_PROTOCOL))
+        logger.info(f"Loaded {role} model {name}: {memory[role] / 2**20:.1f} MB")
+
+    latency = pd.DataFrame([
+        {"batch_size": batch_size, "model": role, **stats}
+        for batch_size in args.batch_sizes
+        for role, stats in replay(models, requests, batch_size, args.max_batches).items()
+    ])
+    logger.info(f"Latency:\n{latency.to_string(index=False)}")
+
+    y_pred = {role: model.predict(requests) for role, model in models.items()}
+
+    run.summary["memory_mb"] = {role: value / 2**20 for role, value in memory.items()}
+    run.summary["max_rss_mb"] = max_rss() / 2**20
+    if y_true is not None:
+        run.summary["mae"] = {role: mean_absolute_error(y_true, pred) for role, pred in y_pred.items()}
+        logger.info(f"MAE: {run.summary['mae']}")
+    run.log({"latency": wandb.Table(dataframe=latency)})
+
+    failures = []
+    if "baseline" in models:
+        delta = y_pred["candidate"] - y_pred["baseline"]
+        deltas = {
+            "mean": delta.mean(),
+            "mean_abs": np.abs(delta).mean(),
+            **{f"p{q}": np.percentile(delta, q) for q in [1, 5, 50, 95, 99]},
+        }
+        logger.info(f"Prediction differences (candidate - baseline): {deltas}")
+        run.summary["prediction_delta"] = deltas
+        run.log({"prediction_delta": wandb.Histogram(delta)})
+
+        # Gate the release on the inference cost of the candidate
+        p95 = latency.pivot(index="batch_size", columns="model", values="latency_p95_ms")
+        latency_ratio = (p95["candidate"] / p95["baseline"]).max()
+        memory_ratio = memory["candidate"] / max(memory["baseline"], 1)
+
+        if latency_ratio > args.max_latency_ratio:
+            failures.append(f"p95 latency ratio {latency_ratio:.2f} > {args.max_latency_ratio}")
+        if memory_ratio > args.max_memory_ratio:
+            failures.append(f"memory ratio {memory_ratio:.2f} > {args.max_memory_ratio}")
+
+        run.summary["latency_ratio"] = latency_ratio
+        run.summary["memory_ratio"] = memory_ratio
+
+    if failures:
+        run.finish(exit_code=1)
+        raise ValueError(f"The candidate model did not pass the shadow test: {'; '.join(failures)}")
+
+    if args.release_alias:
+        logger.info(f"Releasing {args.candidate_model} to {args.release_alias}")
+        artifact = wandb.Api().artifact(f"{run.entity}/{run.project}/{args.candidate_model}")
+        if args.release_alias not in artifact.aliases:
+            # Aliases are unique within an artifact collection, so this also removes it from the old model
+            artifact.aliases.append(args.release_alias)
+            artifact.save()
+
+    run.finish()
+
+
+def replay(models, requests, batch_size, max_batches):
+    """
+    Send the requests in batches of batch_size to all the models, alternating the order of the
+    models at each batch so none of them systematically benefits from warm caches
+
+    :return: a dictionary mapping each model to its latency percentiles (ms per batch) and throughput
+    """
+    starts = range(0, len(requests), batch_size)[:max_batches]
+    timings = {role: [] for role in models}
+
+    roles = list(models)
+    for i, start in enumerate(starts):
+        batch = requests.iloc[start:start + batch_size]
+        for role in (roles if i % 2 == 0 else roles[::-1]):
+            t0 = time.perf_counter()
+            models[role].predict(batch)
+            timings[role].append(time.perf_counter() - t0)
+
+    n_rows = min(len(requests), len(starts) * batch_size)
+    return {
+        role: {
+            "latency_p50_ms": np.percentile(t, 50) * 1000,
+            "latency_p95_ms": np.percentile(t, 95) * 1000,
+            "latency_p99_ms": np.percentile(t, 99) * 1000,
+            "rows_per_s": n_rows / sum(t),
+        }
+        for role, t in timings.items()
+    }
+
+
+def max_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Compare a candidate model with the production one on recorded requests")
+
+    parser.add_argument(
+        "--baseline_model",
+        type=str,
+        help="The model currently in production",
+        required=True
+    )
+
+    parser.add_argument(
+        "--candidate_model",
+        type=str,
+        help="The model that should replace it",
+        required=True
+    )
+
+    parser.add_argument(
+        "--request_log",
+        type=str,
+        help="Artifact with the recorded requests, one JSON object per line in the training schema",
+        required=True
+    )
+
+    parser.add_argument(
+        "--batch_sizes",
+        type=lambda s: [int(size) for size in s.split(",")],
+        help="Comma-separated list of batch sizes used to replay the requests",
+        default="1,10,100,1000"
+    )
+
+    parser.add_argument(
+        "--max_batches",
+        type=int,
+        help="Maximum number of batches replayed for each batch size",
+        default=200
+    )
+
+    parser.add_argument(
+        "--max_latency_ratio",
+        type=float,
+        help="Maximum accepted ratio between the p95 latency of the candidate and the baseline",
+        default=1.5
+    )
+
+    parser.add_argument(
+        "--max_memory_ratio",
+        type=float,
+        help="Maximum accepted ratio between the memory used by the candidate and the baseline",
+        default=2.0
+    )
+
+    parser.add_argument(
+        "--release_alias",
+        type=str,
+        help="Alias given to the candidate when it passes the test (empty: none)",
+        default=""
+    )
+
+    args = parser.parse_args()
+
+    go(args)
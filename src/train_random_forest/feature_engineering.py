@@ -1,11 +1,158 @@
 import pandas as pd
 import numpy as np
+from scipy.spatial import cKDTree
+from sklearn.base import BaseEstimator, TransformerMixin
 
 
-def delta_date_feature(dates):
+class DaysSince(BaseEstimator, TransformerMixin):
     """
     Given a 2d array containing dates (in any format recognized by pd.to_datetime), it returns the delta in days
-    between each date and the most recent date in its column
+    between each date and the most recent date in its column at fit time. The reference dates are fixed at fit
+    time, so the feature of a listing does not depend on the other listings transformed with it
     """
-    date_sanitized = pd.DataFrame(dates).apply(pd.to_datetime)
-    return date_sanitized.apply(lambda d: (d.max() -d).dt.days, axis=0).to_numpy()
+
+    def fit(self, X, y=None):
+        self.reference_ = _to_datetime(X).max()
+        return self
+
+    def transform(self, X):
+        return (self.reference_ - _to_datetime(X)).apply(lambda d: d.dt.days).to_numpy()
+
+
+def _to_datetime(X):
+    return pd.DataFrame(X).apply(pd.to_datetime)
+
+
+# Points of interest used to compute distance features, as (latitude, longitude)
+KEY_POINTS = {
+    "times_square": (40.7580, -73.9855),
+    "financial_district": (40.7060, -74.0086),
+    "central_park": (40.7829, -73.9654),
+    "jfk_airport": (40.6413, -73.7781),
+}
+
+# Approximate length of one degree of latitude and longitude (at the equator) in km
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320
+
+
+class SpatialFeatures(BaseEstimator, TransformerMixin):
+    """
+    Location features of the listings. Expects 3 columns: latitude, longitude and neighbourhood,
+    and returns for each listing:
+
+    - the distance in km to each of the KEY_POINTS
+    - if n_neighbors > 0, the mean and median price of the n_neighbors closest training listings,
+      and their mean distance
+    - if neighbourhood_price is True, the (smoothed) mean price of its neighbourhood
+
+    The price features are target encodings, and are disabled by default: on the sample data the
+    random forest already gets the location from the coordinates and the neighbourhood, and
+    they increased the cross-validated MAE, while the distances slightly reduce it.
+
+    The nearest neighbors are looked up in a KD-tree built at fit time and pickled with the model,
+    so lookups at inference are O(log n) and vectorized over the whole batch. When transforming the
+    training data itself (fit_transform) each listing is excluded from its own nearest neighbors, and
+    the neighbourhood prices are computed out-of-fold, to avoid leaking its price
+    """
+
+    def __init__(self, n_neighbors=0, neighbourhood_price=False, smoothing=10.0, n_folds=5, random_state=None):
+        self.n_neighbors = n_neighbors
+        self.neighbourhood_price = neighbourhood_price
+        self.smoothing = smoothing
+        self.n_folds = n_folds
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        self._fit(X, y)
+        return self
+
+    def fit_transform(self, X, y):
+        self._fit(X, y)
+        return self._transform(X, exclude_self=True)
+
+    def transform(self, X):
+        return self._transform(X, exclude_self=False)
+
+    def get_feature_names_out(self, input_features=None):
+        names = [f"distance_{name}" for name in KEY_POINTS]
+        if self.n_neighbors > 0:
+            names += ["knn_price_mean", "knn_price_median", "knn_distance_mean"]
+        if self.neighbourhood_price:
+            names.append("neighbourhood_price")
+        return np.array(names, dtype=object)
+
+    def _fit(self, X, y):
+        X = pd.DataFrame(X)
+        y = np.asarray(y, dtype=np.float64)
+
+        coords = X.iloc[:, :2].astype(np.float64)
+        self.coords_fill_ = coords.median().to_numpy()
+        # Scale longitude at the average latitude, so euclidean distances are in km
+        self.lon_scale_ = KM_PER_DEGREE_LON * np.cos(np.radians(self.coords_fill_[0]))
+        self.prices_ = y
+
+        if self.n_neighbors > 0:
+            self.n_neighbors_ = min(self.n_neighbors, len(y) - 1)
+            self.tree_ = cKDTree(self._project(coords))
+
+        if self.neighbourhood_price:
+            self.price_mean_ = y.mean()
+            stats = pd.DataFrame({"neighbourhood": X.iloc[:, 2].astype(object), "price": y})
+            stats = stats.groupby("neighbourhood")["price"].agg(["sum", "count"])
+            self.neighbourhood_sum_ = stats["sum"].to_dict()
+            self.neighbourhood_count_ = stats["count"].to_dict()
+
+    def _transform(self, X, exclude_self):
+        X = pd.DataFrame(X)
+        points = self._project(X.iloc[:, :2].astype(np.float64))
+
+        key_points = self._project(pd.DataFrame(list(KEY_POINTS.values())))
+        features = [np.linalg.norm(points[:, None, :] - key_points[None, :, :], axis=2)]
+        if self.n_neighbors > 0:
+            features.append(self._knn_features(points, exclude_self))
+        if self.neighbourhood_price:
+            features.append(self._neighbourhood_price(X.iloc[:, 2].astype(object), exclude_self))
+
+        return np.column_stack(features)
+
+    def _knn_features(self, points, exclude_self):
+        n = points.shape[0]
+
+        if exclude_self:
+            # Query one extra neighbor and drop the listing itself (or the farthest neighbor if
+            # the listing is not among the results because of duplicated coordinates)
+            distances, idx = self.tree_.query(points, k=self.n_neighbors_ + 1)
+            is_self = idx == np.arange(n)[:, None]
+            is_self[~is_self.any(axis=1), -1] = True
+            distances = distances[~is_self].reshape(n, self.n_neighbors_)
+            idx = idx[~is_self].reshape(n, self.n_neighbors_)
+        else:
+            distances, idx = self.tree_.query(points, k=self.n_neighbors_)
+            distances, idx = distances.reshape(n, -1), idx.reshape(n, -1)
+
+        neighbor_prices = self.prices_[idx]
+        return np.column_stack([
+            neighbor_prices.mean(axis=1),
+            np.median(neighbor_prices, axis=1),
+            distances.mean(axis=1),
+        ])
+
+    def _neighbourhood_price(self, neighbourhood, exclude_self):
+        # Smoothed target encoding: neighbourhoods with few listings shrink towards the global mean
+        total = neighbourhood.map(self.neighbourhood_sum_).fillna(0).to_numpy(dtype=np.float64)
+        count = neighbourhood.map(self.neighbourhood_count_).fillna(0).to_numpy(dtype=np.float64)
+        if exclude_self:
+            # Out-of-fold encoding: leaving out just the listing itself would make the feature a
+            # decreasing function of its own price within each neighbourhood, which trees exploit
+            folds = np.random.RandomState(self.random_state).randint(self.n_folds, size=len(neighbourhood))
+            fold_stats = pd.DataFrame({"neighbourhood": neighbourhood, "fold": folds, "price": self.prices_})
+            fold_stats = fold_stats.groupby(["neighbourhood", "fold"])["price"].transform
+            total = total - fold_stats("sum").fillna(0).to_numpy()
+            count = count - fold_stats("count").fillna(0).to_numpy()
+        return (total + self.smoothing * self.price_mean_) / (count + self.smoothing)
+
+    def _project(self, coords):
+        coords = coords.to_numpy(dtype=np.float64)
+        coords = np.where(np.isnan(coords), self.coords_fill_, coords)
+        return np.column_stack([coords[:, 0] * KM_PER_DEGREE_LAT, coords[:, 1] * self.lon_scale_])
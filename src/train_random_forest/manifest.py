@@ -0,0 +1,82 @@
+"""
+Reproducibility manifest of a training run: what data, configuration and environment produced a model
+"""
+import hashlib
+import importlib
+import json
+import os
+import platform
+
+from threadpoolctl import threadpool_info
+
+
+# Libraries whose version can change the trained model
+LIBRARIES = ["numpy", "pandas", "scipy", "sklearn", "pyarrow", "mlflow"]
+
+# Environment variables controlling the size of the native thread pools
+THREAD_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "LOKY_MAX_CPU_COUNT",
+    "PIPELINE_N_JOBS",
+    "PIPELINE_BLAS_THREADS",
+    "PIPELINE_JOBLIB_BACKEND",
+]
+
+
+def file_digest(path):
+    """
+    Return the SHA-256 digest of the content of a file
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def build_manifest(config, data):
+    """
+    Collect everything needed to compare or reproduce a training run
+
+    :param config: the fully resolved configuration of the run
+    :param data: dictionary mapping the name of each input artifact to a dictionary with its W&B
+                 digest and local path
+    :return: the manifest as a JSON-serializable dictionary
+    """
+    libraries = {}
+    for name in LIBRARIES:
+        try:
+            libraries[name] = getattr(importlib.import_module(name), "__version__", None)
+        except ImportError:
+            libraries[name] = None
+
+    return {
+        "data": {
+            name: {"artifact_digest": info["digest"], "sha256": file_digest(info["path"])}
+            for name, info in data.items()
+        },
+        "config": config,
+        "libraries": {"python": platform.python_version(), **libraries},
+        "platform": {
+            "system": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "available_cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        },
+        "threads": {
+            "environment": {var: os.environ.get(var) for var in THREAD_VARIABLES},
+            "pools": [
+                {key: pool.get(key) for key in ["user_api", "internal_api", "version", "num_threads"]}
+                for pool in threadpool_info()
+            ],
+        },
+    }
+
+
+def save_manifest(manifest, path):
+    with open(path, "w") as fp:
+        json.dump(manifest, fp, indent=2, sort_keys=True, default=str)
@@ -0,0 +1,159 @@
+"""
+Out-of-core training: the preprocessed features are written once to memory-mapped arrays, and each tree
+is trained on a bounded-size bootstrap sample read from the mapping
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from joblib import parallel_backend
+from scipy import sparse
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+
+from data_utils.read_dataset import read_dataset
+
+
+logger = logging.getLogger(__name__)
+
+
+def split_positions(path, val_size, stratify_by, random_seed):
+    """
+    Split the rows of the CSV file in train and validation reading only the target (and the
+    stratification column). Returns the positions of the train and validation rows in the file,
+    and the target of all the rows
+    """
+    columns = ["price"] + ([stratify_by] if stratify_by != "none" else [])
+    df = read_dataset(path, columns=columns)
+
+    train_idx, val_idx = train_test_split(
+        np.arange(df.shape[0]),
+        test_size=val_size,
+        stratify=df[stratify_by] if stratify_by != "none" else None,
+        random_state=random_seed
+    )
+
+    return train_idx, val_idx, df["price"].to_numpy()
+
+
+def read_rows(path, columns, positions, n_rows, chunksize):
+    """
+    Read only the rows at the given positions, streaming the file in chunks. The rows are returned
+    in file order
+    """
+    wanted = np.zeros(n_rows, dtype=bool)
+    wanted[positions] = True
+
+    chunks = []
+    start = 0
+    for chunk in read_dataset(path, columns=columns, chunksize=chunksize):
+        chunks.append(chunk[wanted[start:start + chunk.shape[0]]])
+        start += chunk.shape[0]
+
+    # Categoricals with different categories in each chunk become objects, which is fine for the preprocessor
+    return pd.concat(chunks, ignore_index=True)
+
+
+def materialize_features(preprocessor, path, columns, positions, n_rows, filename, chunksize, fitted=None):
+    """
+    Transform the rows at the given positions chunk by chunk, writing the features to a float32
+    memory-mapped array (the dtype used internally by the trees). Row i of the array holds the
+    features of the row at positions[i]
+
+    :param fitted: optional tuple (positions, features) with the features already computed for some
+                   of the rows, which are copied instead of being transformed again
+    """
+    slots = np.full(n_rows, -1, dtype=np.int64)
+    slots[positions] = np.arange(positions.shape[0])
+
+    features = None
+    if fitted is not None:
+        fitted_positions, fitted_features = fitted
+        features = open_features(filename, positions.shape[0], fitted_features.shape[1])
+        features[slots[fitted_positions]] = to_dense(fitted_features)
+        slots[fitted_positions] = -1
+
+    start = 0
+    for chunk in read_dataset(path, columns=columns, chunksize=chunksize):
+        chunk_slots = slots[start:start + chunk.shape[0]]
+        start += chunk.shape[0]
+
+        selected = chunk_slots >= 0
+        if not selected.any():
+            continue
+
+        X = to_dense(preprocessor.transform(chunk[selected]))
+
+        if features is None:
+            features = open_features(filename, positions.shape[0], X.shape[1])
+        features[chunk_slots[selected]] = X
+
+    features.flush()
+    logger.info(f"Materialized {features.shape[0]} x {features.shape[1]} features in {filename}")
+
+    # Re-open read-only, so worker processes map the same pages instead of receiving a copy
+    return np.load(filename, mmap_mode="r")
+
+
+def open_features(filename, n_rows, n_features):
+    return np.lib.format.open_memmap(filename, mode="w+", dtype=np.float32, shape=(n_rows, n_features))
+
+
+def to_dense(X):
+    return X.toarray() if sparse.issparse(X) else X
+
+
+def fit_out_of_core(sk_pipe, path, columns, args, memmap_dir, joblib_backend="loky"):
+    """
+    Fit the inference pipeline without holding the whole training set in memory:
+
+    1 - the preprocessor is fitted on a random sample of the training rows
+    2 - the training and validation features are written to memory-mapped arrays in memmap_dir
+    3 - the random forest is trained on the mapping, each tree on a bootstrap sample of at most
+        args.max_samples rows, using worker processes (with the loky joblib_backend) that share
+        the mapping zero-copy
+
+    NOTE: the spatial index of the preprocessor only contains the listings in the sample
+
+    :return: a tuple (sk_pipe, X_example, X_train, y_train, X_val, y_val) where X_example holds a
+             few rows of raw input and the X arrays are the memory-mapped features
+    """
+    train_idx, val_idx, y = split_positions(path, args.val_size, args.stratify_by, args.random_seed)
+    n_rows = y.shape[0]
+    feature_columns = [col for col in columns if col != "price"]
+    logger.info(f"Training on {train_idx.shape[0]} rows, validating on {val_idx.shape[0]} rows")
+
+    rng = np.random.RandomState(args.random_seed)
+    sample_idx = np.sort(rng.choice(
+        train_idx, size=min(args.preprocessor_sample_size, train_idx.shape[0]), replace=False
+    ))
+    sample = read_rows(path, feature_columns, sample_idx, n_rows, args.chunksize)
+
+    logger.info(f"Fitting the preprocessor on {sample_idx.shape[0]} rows")
+    preprocessor = sk_pipe["preprocessor"]
+    # The features of the sample must come from fit_transform: transform would find each listing
+    # among its own nearest neighbors in the spatial index, leaking its price
+    X_sample = preprocessor.fit_transform(sample, y[sample_idx])
+
+    X_train, X_val = [
+        materialize_features(
+            preprocessor, path, feature_columns, idx, n_rows, os.path.join(memmap_dir, f"X_{name}.npy"),
+            args.chunksize, fitted
+        )
+        for name, idx, fitted in [("train", train_idx, (sample_idx, X_sample)), ("val", val_idx, None)]
+    ]
+
+    random_forest = sk_pipe["random_forest"]
+    if random_forest.oob_score:
+        # Out-of-bag predictions would index (and copy) almost the whole array for each tree
+        logger.warning("The out-of-bag score is not computed in out-of-core mode")
+    random_forest.set_params(max_samples=args.max_samples, bootstrap=True, oob_score=False)
+
+    logger.info(f"Fitting the random forest on bootstrap samples of {args.max_samples} rows")
+    with parallel_backend(joblib_backend):
+        random_forest.fit(X_train, y[train_idx])
+
+    sk_pipe = Pipeline(steps=[("preprocessor", preprocessor), ("random_forest", random_forest)])
+
+    return sk_pipe, sample.iloc[:5], X_train, y[train_idx], X_val, y[val_idx]
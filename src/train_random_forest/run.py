@@ -6,13 +6,14 @@ import argparse
 import logging
 import os
 import shutil
+import tempfile
 import matplotlib.pyplot as plt
 
 import mlflow
 import json
 
-import pandas as pd
 import numpy as np
+from sklearn.base import clone
 from sklearn.compose import ColumnTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.impute import SimpleImputer
@@ -21,28 +22,45 @@ from sklearn.preprocessing import OrdinalEncoder, FunctionTransformer, OneHotEnc
 
 import wandb
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_absolute_error
+from sklearn.metrics import mean_absolute_error, r2_score
 from sklearn.pipeline import Pipeline, make_pipeline
 
-
-def delta_date_feature(dates):
-    """
-    Given a 2d array containing dates (in any format recognized by pd.to_datetime), it returns the delta in days
-    between each date and the most recent date in its column
-    """
-    date_sanitized = pd.DataFrame(dates).apply(pd.to_datetime)
-    return date_sanitized.apply(lambda d: (d.max() -d).dt.days, axis=0).to_numpy()
+from data_utils.read_dataset import read_dataset
+from resource_utils.configure_resources import configure_resources
+from feature_engineering import DaysSince, SpatialFeatures
+from manifest import build_manifest, save_manifest
+from out_of_core import fit_out_of_core
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
 
+# Input columns used by the inference pipeline
+FEATURE_COLUMNS = [
+    "room_type",
+    "neighbourhood_group",
+    "minimum_nights",
+    "number_of_reviews",
+    "reviews_per_month",
+    "calculated_host_listings_count",
+    "availability_365",
+    "longitude",
+    "latitude",
+    "neighbourhood",
+    "last_review",
+    "name",
+]
+
+
 def go(args):
 
     run = wandb.init(job_type="train_random_forest")
     run.config.update(args)
 
+    resources = configure_resources("train_random_forest")
+    run.summary['resources'] = resources
+
     # Get the Random Forest configuration and update W&B
     with open(args.rf_config) as fp:
         rf_config = json.load(fp)
@@ -51,53 +69,94 @@ def go(args):
     # Fix the random seed for the Random Forest, so we get reproducible results
     rf_config['random_state'] = args.random_seed
 
+    # Unless set explicitly, use the workers assigned to this step
+    if rf_config.get('n_jobs') is None:
+        rf_config['n_jobs'] = resources['n_jobs']
+
     # Use run.use_artifact(...).file() to get the train and validation artifact
     # and save the returned path in train_local_pat
-    trainval_local_path = run.use_artifact(args.trainval_artifact).file()
+    trainval_artifact = run.use_artifact(args.trainval_artifact)
+    trainval_local_path = trainval_artifact.file()
    
-    X = pd.read_csv(trainval_local_path)
-    y = X.pop("price")  # this removes the column "price" from X and puts it into y
+    # Only read the columns used by the inference pipeline (plus target and stratification)
+    columns = FEATURE_COLUMNS + ["price"]
+    if args.stratify_by != "none" and args.stratify_by not in columns:
+        columns.append(args.stratify_by)
 
-    logger.info(f"Minimum price: {y.min()}, Maximum price: {y.max()}")
+    logger.info("Preparing sklearn pipeline")
 
-    # Fix stratification issue: set to None if 'stratify_by' is 'none'
-    stratify_col = X[args.stratify_by] if args.stratify_by in X.columns else None
-    
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=args.val_size, stratify=stratify_col, random_state=args.random_seed
+    sk_pipe, processed_features = get_inference_pipeline(
+        rf_config, args.max_tfidf_features, args.n_neighbors, args.neighbourhood_price
     )
 
+    memmap_dir = None
+    if args.out_of_core:
+        logger.info("Fitting out-of-core")
+        # Memory-mapped features, deleted at the end of the run
+        memmap_dir = tempfile.TemporaryDirectory(dir=args.memmap_dir)
+        sk_pipe, X_example, X_train, y_train, X_val, y_val = fit_out_of_core(
+            sk_pipe, trainval_local_path, columns, args, memmap_dir.name, resources['joblib_backend'] or "loky"
+        )
 
-    logger.info("Preparing sklearn pipeline")
+        # The features are already computed, so only the random forest is needed from here on
+        model, n_jobs_param = sk_pipe["random_forest"], "n_jobs"
+    else:
+        X = read_dataset(trainval_local_path, columns=columns)
+        y = X.pop("price")  # this removes the column "price" from X and puts it into y
+
+        logger.info(f"Minimum price: {y.min()}, Maximum price: {y.max()}")
+
+        # Fix stratification issue: set to None if 'stratify_by' is 'none'
+        stratify_col = X[args.stratify_by] if args.stratify_by in X.columns else None
 
-    sk_pipe, processed_features = get_inference_pipeline(rf_config, args.max_tfidf_features)
+        X_train, X_val, y_train, y_val = train_test_split(
+            X, y, test_size=args.val_size, stratify=stratify_col, random_state=args.random_seed
+        )
 
-    # Then fit it to the X_train, y_train data
-    logger.info("Fitting")
+        # Then fit it to the X_train, y_train data
+        logger.info("Fitting")
 
-    sk_pipe.fit(X_train, y_train) # added
+        sk_pipe.fit(X_train, y_train) # added
+
+        X_example = X_train.iloc[:5]
+        model, n_jobs_param = sk_pipe, "random_forest__n_jobs"
 
     # Compute r2 and MAE
     logger.info("Scoring")
-    r_squared = sk_pipe.score(X_val, y_val)
+    y_pred = model.predict(X_val)
 
-    y_pred = sk_pipe.predict(X_val)
+    r_squared = r2_score(y_val, y_pred)
     mae = mean_absolute_error(y_val, y_pred)
 
     logger.info(f"Score: {r_squared}")
     logger.info(f"MAE: {mae}")
 
+    manifest = build_manifest(
+        config={**vars(args), "rf_config": rf_config},
+        data={args.trainval_artifact: {"digest": trainval_artifact.digest, "path": trainval_local_path}}
+    )
+
+    if args.verify_reproducibility:
+        manifest["verified_n_jobs"] = verify_reproducibility(model, X_train, y_train, X_val, n_jobs_param)
+
+    if memmap_dir is not None:
+        memmap_dir.cleanup()
+
     logger.info("Exporting model")
 
     # Save model package in the MLFlow sklearn format
     if os.path.exists("random_forest_dir"):
         shutil.rmtree("random_forest_dir")
 
+    # The spatial features are defined in a separate module, which must be available when
+    # the model is loaded
     mlflow.sklearn.save_model( # added
         sk_pipe,
         path="random_forest_dir",
-        input_example=X_train.iloc[:5]
+        input_example=X_example,
+        code_paths=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature_engineering.py")]
     )
+    save_manifest(manifest, os.path.join("random_forest_dir", "manifest.json"))
 
     # Upload the model we just exported to W&B
     artifact = wandb.Artifact(
@@ -109,6 +168,10 @@ def go(args):
     artifact.add_dir('random_forest_dir')
     run.log_artifact(artifact)
 
+    # The manifest is stored both with the model and in the summary of the run. It is not written
+    # to the working directory, which is the source tree of this step
+    run.summary['manifest'] = manifest
+
     # Plot feature importance
     fig_feat_imp = plot_feature_importance(sk_pipe, processed_features)
 
@@ -125,6 +188,36 @@ def go(args):
     )
 
 
+def verify_reproducibility(model, X_train, y_train, X_val, n_jobs_param="random_forest__n_jobs"):
+    """
+    Train the model again with a different number of jobs and check that it returns exactly the
+    same predictions. Returns the number of jobs used for the check
+    """
+    n_jobs = model.get_params()[n_jobs_param]
+    check_n_jobs = 1 if n_jobs != 1 else (os.cpu_count() or 1)
+    logger.info(f"Verifying reproducibility: re-training with n_jobs={check_n_jobs} (was {n_jobs})")
+
+    check_pipe = clone(model).set_params(**{n_jobs_param: check_n_jobs})
+    check_pipe.fit(X_train, y_train)
+
+    # When predicting in parallel the trees are summed in a non-deterministic order, so both
+    # models predict sequentially
+    model.set_params(**{n_jobs_param: 1})
+    check_pipe.set_params(**{n_jobs_param: 1})
+    y_pred = model.predict(X_val)
+    check_pred = check_pipe.predict(X_val)
+    model.set_params(**{n_jobs_param: n_jobs})
+
+    if not np.array_equal(y_pred, check_pred):
+        raise RuntimeError(
+            f"Training is not reproducible: predictions differ by up to "
+            f"{np.max(np.abs(y_pred - check_pred))} with n_jobs={check_n_jobs}"
+        )
+
+    logger.info("Predictions are identical")
+    return check_n_jobs
+
+
 def plot_feature_importance(pipe, feat_names):
     # We collect the feature importance for all non-nlp features first
     feat_imp = pipe["random_forest"].feature_importances_[: len(feat_names)-1]
@@ -141,7 +234,7 @@ def plot_feature_importance(pipe, feat_names):
     return fig_feat_imp
 
 
-def get_inference_pipeline(rf_config, max_tfidf_features):
+def get_inference_pipeline(rf_config, max_tfidf_features, n_neighbors=0, neighbourhood_price=False):
     # Let's handle the categorical features first
     # Ordinal categorical are categorical values for which the order is meaningful, for example
     # for room type: 'Entire home/apt' > 'Private room' > 'Shared room'
@@ -179,10 +272,20 @@ def get_inference_pipeline(rf_config, max_tfidf_features):
     # A MINIMAL FEATURE ENGINEERING step:
     # we create a feature that represents the number of days passed since the last review
     # First we impute the missing review date with an old date (because there hasn't been
-    # a review for a long time), and then we create a new feature from it,
+    # a review for a long time), and then we create a new feature from it, relative to the most
+    # recent review in the training data
     date_imputer = make_pipeline(
         SimpleImputer(strategy='constant', fill_value='2010-01-01'),
-        FunctionTransformer(delta_date_feature, check_inverse=False, validate=False)
+        DaysSince()
+    )
+
+    # Location features: distance to points of interest and, optionally, the prices of the nearby
+    # training listings and of the neighbourhood
+    spatial_columns = ["latitude", "longitude", "neighbourhood"]
+    spatial_features = SpatialFeatures(
+        n_neighbors=n_neighbors,
+        neighbourhood_price=neighbourhood_price,
+        random_state=rf_config.get("random_state")
     )
 
     # Some minimal NLP for the "name" column
@@ -204,12 +307,20 @@ def get_inference_pipeline(rf_config, max_tfidf_features):
             ("non_ordinal_cat", non_ordinal_categorical_preproc, non_ordinal_categorical),
             ("impute_zero", zero_imputer, zero_imputed),
             ("transform_date", date_imputer, ["last_review"]),
+            ("spatial", spatial_features, spatial_columns),
             ("transform_name", name_tfidf, ["name"])
         ],
         remainder="drop",  # This drops the columns that we do not transform
     )
 
-    processed_features = ordinal_categorical + non_ordinal_categorical + zero_imputed + ["last_review", "name"]
+    processed_features = (
+        ordinal_categorical
+        + non_ordinal_categorical
+        + zero_imputed
+        + ["last_review"]
+        + list(spatial_features.get_feature_names_out())
+        + ["name"]
+    )
 
     # Create random forest
     random_forest = RandomForestRegressor(**rf_config)
@@ -278,6 +389,63 @@ if __name__ == "__main__":
         type=int
     )
 
+    parser.add_argument(
+        "--n_neighbors",
+        help="Number of nearby listings used to compute the spatial price features (0 disables them)",
+        default=0,
+        type=int
+    )
+
+    parser.add_argument(
+        "--neighbourhood_price",
+        help="Add the smoothed mean price of the neighbourhood of each listing as a feature",
+        default=False,
+        type=lambda s: s.lower() in ("true", "1", "yes")
+    )
+
+    parser.add_argument(
+        "--verify_reproducibility",
+        help="Train a second time with a different number of jobs and check the predictions are identical",
+        default=False,
+        type=lambda s: s.lower() in ("true", "1", "yes")
+    )
+
+    parser.add_argument(
+        "--out_of_core",
+        help="Train from memory-mapped features, each tree on a bootstrap sample of at most max_samples rows",
+        default=False,
+        type=lambda s: s.lower() in ("true", "1", "yes")
+    )
+
+    parser.add_argument(
+        "--max_samples",
+        help="Size of the bootstrap sample of each tree in out-of-core mode. Fraction of the training "
+        "set, or number of rows",
+        default=0.5,
+        type=lambda s: float(s) if float(s) <= 1 else int(float(s))
+    )
+
+    parser.add_argument(
+        "--preprocessor_sample_size",
+        help="Number of training rows used to fit the preprocessor in out-of-core mode",
+        default=100000,
+        type=int
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        help="Number of rows read at a time in out-of-core mode",
+        default=100000,
+        type=int
+    )
+
+    parser.add_argument(
+        "--memmap_dir",
+        help="Directory for the memory-mapped features in out-of-core mode (default: system temporary directory)",
+        default=None,
+        required=False
+    )
+
     parser.add_argument(
         "--output_artifact",
         type=str,
@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from feature_engineering import DaysSince, KEY_POINTS, SpatialFeatures
+
+
+@pytest.fixture
+def listings():
+    # Two blocks of listings far from each other, in two neighbourhoods. The listings of each block
+    # are on a line, at increasing distances, so the nearest neighbors are unambiguous
+    return pd.DataFrame({
+        "latitude": [40.700, 40.701, 40.703, 40.706, 40.800, 40.801, 40.803, 40.806],
+        "longitude": [-73.950, -73.951, -73.953, -73.956, -73.850, -73.851, -73.853, -73.856],
+        "neighbourhood": ["Harlem"] * 4 + ["Astoria"] * 4,
+        "price": [100.0, 110.0, 120.0, 130.0, 300.0, 310.0, 320.0, 330.0],
+    })
+
+
+def split(df):
+    return df[["latitude", "longitude", "neighbourhood"]], df["price"]
+
+
+def test_feature_names(listings):
+    X, y = split(listings)
+
+    all_features = {"n_neighbors": 3, "neighbourhood_price": True}
+    for params in [{}, {"n_neighbors": 3}, {"neighbourhood_price": True}, all_features]:
+        spatial = SpatialFeatures(**params)
+        assert spatial.fit_transform(X, y).shape == (len(X), len(spatial.get_feature_names_out()))
+        assert spatial.fit(X, y).transform(X).shape == (len(X), len(spatial.get_feature_names_out()))
+
+    assert list(SpatialFeatures().get_feature_names_out()) == [f"distance_{name}" for name in KEY_POINTS]
+
+
+def test_key_point_distances(listings):
+    X, y = split(listings)
+    spatial = SpatialFeatures().fit(X, y)
+
+    key_points = pd.DataFrame(list(KEY_POINTS.values()), columns=["latitude", "longitude"])
+    distances = spatial.transform(key_points.assign(neighbourhood="Harlem"))
+
+    np.testing.assert_allclose(np.diag(distances), 0, atol=1e-9)
+    # Times Square to Central Park is about 3 km
+    assert 2.5 < distances[0, 2] < 3.5
+
+
+def test_fit_transform_excludes_each_listing(listings):
+    X, y = split(listings)
+    spatial = SpatialFeatures(n_neighbors=1)
+    knn_mean = list(spatial.get_feature_names_out()).index("knn_price_mean")
+
+    # In fit_transform each listing gets the price of its closest other listing, in transform its own
+    np.testing.assert_array_equal(
+        spatial.fit_transform(X, y)[:, knn_mean], [110, 100, 110, 120, 310, 300, 310, 320]
+    )
+    np.testing.assert_array_equal(spatial.transform(X)[:, knn_mean], y)
+
+
+def test_duplicate_coordinates(listings):
+    listings = pd.concat([listings, listings.iloc[[0]].assign(price=500.0)], ignore_index=True)
+    X, y = split(listings)
+    spatial = SpatialFeatures(n_neighbors=2)
+    knn_mean = list(spatial.get_feature_names_out()).index("knn_price_mean")
+
+    features = spatial.fit_transform(X, y)
+
+    # Each copy sees the other copy and its closest neighbor, never itself
+    np.testing.assert_array_equal(features[[0, 8], knn_mean], [(500 + 110) / 2, (100 + 110) / 2])
+
+
+def test_more_duplicates_than_neighbors(listings):
+    # The tree may return the other copies of a listing and not the listing itself
+    copies = pd.concat([listings.iloc[[0]]] * 3, ignore_index=True).assign(price=[500.0, 600.0, 700.0])
+    X, y = split(pd.concat([copies, listings], ignore_index=True))
+    spatial = SpatialFeatures(n_neighbors=1)
+    knn_mean = list(spatial.get_feature_names_out()).index("knn_price_mean")
+
+    features = spatial.fit_transform(X, y)[:3, knn_mean]
+
+    assert set(features) <= {500, 600, 700, 100}
+    assert not (features == y[:3]).any()
+
+
+def test_n_neighbors_is_clamped(listings):
+    X, y = split(listings.iloc[:3])
+    spatial = SpatialFeatures(n_neighbors=10)
+    knn_mean = list(spatial.get_feature_names_out()).index("knn_price_mean")
+
+    features = spatial.fit_transform(X, y)
+
+    assert spatial.n_neighbors_ == 2
+    np.testing.assert_array_equal(features[:, knn_mean], [115, 110, 105])
+    np.testing.assert_array_equal(spatial.transform(X)[:, knn_mean], [105, 105, 115])
+
+
+def test_neighbourhood_price_is_out_of_fold(listings):
+    X, y = split(listings)
+    spatial = SpatialFeatures(neighbourhood_price=True, smoothing=0, n_folds=2, random_state=0)
+
+    # Without smoothing, the listings whose neighbourhood only has listings in their fold get NaN
+    with np.errstate(invalid="ignore"):
+        features = spatial.fit_transform(X, y)[:, -1]
+
+    # Each listing gets the mean price of the listings of its neighbourhood in the other folds
+    folds = np.random.RandomState(0).randint(2, size=len(X))
+    for i in range(len(X)):
+        other = (listings["neighbourhood"] == listings["neighbourhood"][i]) & (folds != folds[i])
+        if other.any():
+            assert features[i] == pytest.approx(y[other].mean())
+    # At inference the encoding uses all the training listings
+    np.testing.assert_allclose(spatial.transform(X)[:, -1], [115] * 4 + [315] * 4)
+
+
+def test_neighbourhood_price_smoothing(listings):
+    X, y = split(listings)
+    spatial = SpatialFeatures(neighbourhood_price=True, smoothing=4).fit(X, y)
+
+    features = spatial.transform(X.assign(neighbourhood=["Harlem", "Narnia"] + ["Astoria"] * 6))[:, -1]
+
+    # Halfway between the neighbourhood and the global mean, which unknown neighbourhoods get
+    assert features[0] == pytest.approx((115 + 215) / 2)
+    assert features[1] == pytest.approx(215)
+
+
+def test_days_since_does_not_depend_on_the_batch():
+    dates = pd.DataFrame({"last_review": ["2019-07-01", "2019-06-01", "2018-07-01"]})
+    days_since = DaysSince().fit(dates)
+
+    np.testing.assert_array_equal(days_since.transform(dates).ravel(), [0, 30, 365])
+    np.testing.assert_array_equal(days_since.transform(dates.iloc[[2]]).ravel(), [365])
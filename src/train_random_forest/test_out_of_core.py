@@ -0,0 +1,132 @@
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.pipeline import Pipeline
+
+from feature_engineering import SpatialFeatures
+from out_of_core import fit_out_of_core, materialize_features, read_rows, split_positions
+
+
+N_ROWS = 300
+COLUMNS = ["neighbourhood_group", "neighbourhood", "latitude", "longitude", "price", "minimum_nights"]
+
+
+@pytest.fixture
+def csv(tmp_path):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        "neighbourhood_group": rng.choice(["Brooklyn", "Manhattan"], size=N_ROWS),
+        "neighbourhood": rng.choice(["Astoria", "Harlem", "Chelsea", "Bushwick"], size=N_ROWS),
+        "latitude": 40.6 + rng.rand(N_ROWS) * 0.3,
+        "longitude": -74.0 + rng.rand(N_ROWS) * 0.3,
+        "price": rng.randint(20, 300, size=N_ROWS),
+        # The row number, to check which row ends up where
+        "minimum_nights": np.arange(N_ROWS),
+    })
+    path = tmp_path / "trainval.csv"
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def make_pipeline():
+    preprocessor = ColumnTransformer([
+        ("spatial", SpatialFeatures(n_neighbors=5, neighbourhood_price=True, random_state=0), ["latitude", "longitude", "neighbourhood"]),
+        ("nights", "passthrough", ["minimum_nights"]),
+    ])
+    random_forest = RandomForestRegressor(n_estimators=5, random_state=0, oob_score=True)
+    return Pipeline([("preprocessor", preprocessor), ("random_forest", random_forest)])
+
+
+def make_args(**kwargs):
+    args = dict(
+        val_size=0.2, stratify_by="none", random_seed=42, preprocessor_sample_size=100, chunksize=64, max_samples=0.5
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def test_read_rows(csv):
+    positions = np.array([250, 3, 64, 65, 128])
+
+    rows = read_rows(csv, ["minimum_nights", "price"], positions, N_ROWS, chunksize=64)
+
+    # In file order, whatever the order of the positions
+    assert list(rows["minimum_nights"]) == sorted(positions)
+
+
+def test_materialize_features(csv, tmp_path):
+    preprocessor = ColumnTransformer([("nights", "passthrough", ["minimum_nights"])])
+    preprocessor.fit(pd.read_csv(csv))
+    # Shuffled, like the positions returned by train_test_split
+    positions = np.random.RandomState(0).permutation(N_ROWS)[:200]
+
+    features = materialize_features(
+        preprocessor, csv, COLUMNS, positions, N_ROWS, str(tmp_path / "X.npy"), chunksize=64
+    )
+
+    assert features.shape == (200, 1)
+    np.testing.assert_array_equal(features[:, 0], positions)
+
+
+def test_materialize_features_copies_fitted_rows(csv, tmp_path):
+    preprocessor = ColumnTransformer([("nights", "passthrough", ["minimum_nights"])])
+    preprocessor.fit(pd.read_csv(csv))
+    positions = np.random.RandomState(0).permutation(N_ROWS)[:200]
+    fitted_positions = positions[::10]
+
+    features = materialize_features(
+        preprocessor, csv, COLUMNS, positions, N_ROWS, str(tmp_path / "X.npy"), chunksize=64,
+        fitted=(fitted_positions, -np.ones((fitted_positions.shape[0], 1)))
+    )
+
+    is_fitted = np.isin(positions, fitted_positions)
+    np.testing.assert_array_equal(features[is_fitted, 0], -1)
+    np.testing.assert_array_equal(features[~is_fitted, 0], positions[~is_fitted])
+
+
+def test_fit_out_of_core(csv, tmp_path, caplog):
+    args = make_args()
+
+    with caplog.at_level(logging.WARNING):
+        sk_pipe, X_example, X_train, y_train, X_val, y_val = fit_out_of_core(
+            make_pipeline(), csv, COLUMNS, args, str(tmp_path), joblib_backend="threading"
+        )
+
+    assert "out-of-bag" in caplog.text
+    assert not sk_pipe["random_forest"].oob_score
+    assert X_train.shape[0] + X_val.shape[0] == N_ROWS
+
+    # The last feature is minimum_nights, i.e. the number of the row in the file
+    df = pd.read_csv(csv)
+    train_rows = df.loc[X_train[:, -1].astype(int)]
+    val_rows = df.loc[X_val[:, -1].astype(int)]
+    np.testing.assert_array_equal(train_rows["price"], y_train)
+    np.testing.assert_array_equal(val_rows["price"], y_val)
+
+    # Predicting from the memory-mapped features is the same as predicting from the raw rows
+    np.testing.assert_allclose(sk_pipe["random_forest"].predict(X_val), sk_pipe.predict(val_rows))
+
+    # The rows used to fit the preprocessor have the features of fit_transform, which exclude each
+    # listing from its own neighbors, and the other training rows those of transform
+    # Same sample as fit_out_of_core
+    sample_positions = np.random.RandomState(args.random_seed).choice(
+        split_positions(csv, args.val_size, args.stratify_by, args.random_seed)[0],
+        size=args.preprocessor_sample_size, replace=False
+    )
+    sample = train_rows.index.isin(sample_positions)
+    assert 0 < sample.sum() < len(train_rows)
+
+    sample_rows = df.loc[np.sort(sample_positions)]
+    expected = clone(make_pipeline()["preprocessor"]).fit_transform(sample_rows, sample_rows["price"])
+    np.testing.assert_allclose(
+        X_train[sample][np.argsort(train_rows.index[sample])], expected, rtol=1e-6
+    )
+    np.testing.assert_allclose(
+        X_train[~sample], sk_pipe["preprocessor"].transform(train_rows[~sample]), rtol=1e-6
+    )
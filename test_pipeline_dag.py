@@ -0,0 +1,129 @@
+import threading
+
+import pytest
+
+from pipeline_dag import PipelineDAG, Step, StepFailed, load_state, save_state
+
+
+def make_dag(ran, fail=()):
+    """
+    A DAG shaped like the pipeline: the check gates the training through a marker, while the split
+    can run at the same time as the check
+    """
+    def step(name):
+        def run():
+            ran.append(name)
+            if name in fail:
+                raise ValueError(f"{name} failed")
+        return run
+
+    return PipelineDAG([
+        Step("download", [], ["raw"], step("download")),
+        Step("clean", ["raw"], ["clean"], step("clean")),
+        Step("check", ["clean"], ["check_passed"], step("check")),
+        Step("split", ["clean"], ["trainval", "test"], step("split")),
+        Step("train", ["trainval", "check_passed"], ["model"], step("train")),
+        Step("promote", ["model", "test"], ["model"], step("promote")),
+        Step("evaluate", ["model", "test"], [], step("evaluate")),
+    ])
+
+
+ALL_STEPS = ["download", "clean", "check", "split", "train", "promote", "evaluate"]
+
+
+def test_dependencies():
+    dag = make_dag([])
+
+    assert dag.dependencies["check"] == {"clean"}
+    assert dag.dependencies["train"] == {"split", "check"}
+    # "model" is re-versioned by promote, which evaluate must wait for
+    assert dag.dependencies["evaluate"] == {"train", "promote", "split"}
+
+
+def test_upstream_skips_inactive_steps():
+    dag = make_dag([])
+
+    assert dag.upstream("train", {"download", "train"}) == {"download"}
+    assert dag.upstream("clean", {"clean"}) == set()
+
+
+def test_run_in_dependency_order():
+    ran = []
+    durations = make_dag(ran).run(ALL_STEPS, max_workers=2)
+
+    assert sorted(ran) == sorted(ALL_STEPS)
+    assert set(durations) == set(ALL_STEPS)
+    for step, dep in [("clean", "download"), ("train", "check"), ("train", "split"), ("evaluate", "promote")]:
+        assert ran.index(dep) < ran.index(step)
+
+
+def test_run_independent_steps_concurrently():
+    # Both steps must be running at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    dag = PipelineDAG([
+        Step("a", [], ["a"], barrier.wait),
+        Step("b", [], ["b"], barrier.wait),
+    ])
+
+    assert set(dag.run(["a", "b"], max_workers=2)) == {"a", "b"}
+
+
+def test_failed_gate_skips_downstream_steps():
+    ran = []
+
+    with pytest.raises(StepFailed, match="check, train, promote, evaluate"):
+        make_dag(ran, fail={"check"}).run(ALL_STEPS, max_workers=2)
+
+    # The split does not depend on the check, so it still runs
+    assert sorted(ran) == ["check", "clean", "download", "split"]
+
+
+def test_completed_steps_are_skipped():
+    ran = []
+    succeeded = []
+    make_dag(ran).run(ALL_STEPS, completed={"download", "clean"}, on_success=succeeded.append)
+
+    assert "download" not in ran and "clean" not in ran
+    assert sorted(succeeded) == sorted(ALL_STEPS[2:])
+
+
+def test_unknown_steps():
+    with pytest.raises(ValueError, match="Unknown steps: nope"):
+        make_dag([]).run(["download", "nope"])
+
+
+def test_critical_path():
+    dag = make_dag([])
+    durations = {"download": 1, "clean": 1, "check": 5, "split": 2, "train": 10, "promote": 1, "evaluate": 1}
+
+    path, total = dag.critical_path(durations)
+
+    assert path == ["download", "clean", "check", "train", "promote", "evaluate"]
+    assert total == 19
+
+
+def test_concurrency():
+    dag = make_dag([])
+
+    assert dag.concurrency(ALL_STEPS, max_workers=4) == {
+        "download": 1, "clean": 1, "check": 2, "split": 2, "train": 1, "promote": 1, "evaluate": 1
+    }
+    # Limited by the number of workers, and by the steps that actually run
+    assert dag.concurrency(ALL_STEPS, max_workers=1)["check"] == 1
+    assert dag.concurrency(["check", "train"], max_workers=4) == {"check": 1, "train": 1}
+
+
+def test_state(tmp_path):
+    state_file = str(tmp_path / "state" / "run.json")
+
+    assert load_state(state_file, "abc") == []
+    save_state(state_file, {"clean", "download"}, "abc")
+    assert load_state(state_file, "abc") == ["clean", "download"]
+
+
+def test_state_of_another_configuration_is_ignored(tmp_path):
+    state_file = str(tmp_path / "run.json")
+
+    save_state(state_file, {"clean", "download"}, "abc")
+
+    assert load_state(state_file, "def") == []